@@ -1,33 +1,58 @@
 # action.py
-import os
 import asyncio
+from typing import List, Optional
 from pydantic import BaseModel
-from mcp.client.stdio import stdio_client
-from mcp import ClientSession, StdioServerParameters
+import tool_results
+from tool_results import ToolResult
+from mcp_pool import get_pool
+from telemetry import metrics, span
+from decision import ToolCall
+from config import tool_call_timeout, max_parallel_tool_calls
 
 class ActionInput(BaseModel):
     action_type: str
     tool_name: str
     arguments: dict
+    tool_calls: List[ToolCall] = []
 
 class ActionOutput(BaseModel):
     result: str
+    outputs: List[ToolResult] = []
 
-async def call_mcp_tool(tool_name: str, arguments: dict) -> str:
-    server_params = StdioServerParameters(
-        command="python",
-        args=["mcp_server.py", "--env-key", os.getenv("GEMINI_API_KEY")]
-    )
-    async with stdio_client(server_params) as (read, write):
-        async with ClientSession(read, write) as session:
-            await session.initialize()
-            result = await session.call_tool(tool_name, arguments)
-            return str(result.content if hasattr(result, 'content') else result)
-
-def take_action(act_input: ActionInput) -> ActionOutput:
+async def call_tool_result(tool_name: str, arguments: dict, timeout: Optional[float] = None) -> ToolResult:
+    # Reuse the long-lived server processes instead of spawning one per call
+    return tool_results.from_mcp(tool_name, await get_pool().call_tool(tool_name, arguments, timeout))
+
+async def run_mcp_tools(calls: List[ToolCall], timeout: float = tool_call_timeout) -> List[ToolResult]:
+    """Run independent tool calls concurrently; a failed or slow call does not sink the others."""
+    async def run(call: ToolCall) -> ToolResult:
+        with span("tool", tool=call.tool_name) as record:
+            try:
+                # The pool enforces the timeout so it can restart a server that stopped answering
+                result = await call_tool_result(call.tool_name, call.arguments, timeout)
+                record.update(status="ok" if result.ok else "error", result_tokens=result.tokens(),
+                              raw_chars=result.raw_chars, truncated=result.truncated)
+                return result
+            except asyncio.TimeoutError:
+                record["status"] = "timeout"
+                return tool_results.error_result(call.tool_name, f"timed out after {timeout:g}s")
+            except Exception as e:
+                record["status"] = "error"
+                return tool_results.error_result(call.tool_name, str(e))
+            finally:
+                metrics.inc("tool_calls_total", tool=call.tool_name, status=record.get("status", "cancelled"))
+
+    return list(await asyncio.gather(*(run(call) for call in calls)))
+
+async def take_action(act_input: ActionInput) -> ActionOutput:
     if act_input.action_type == "function_call":
-        result = asyncio.run(call_mcp_tool(act_input.tool_name, act_input.arguments))
-        return ActionOutput(result=f"[MCP Response] {result}")
+        calls = act_input.tool_calls or [ToolCall(tool_name=act_input.tool_name, arguments=act_input.arguments)]
+        skipped = calls[max_parallel_tool_calls:]
+        outputs = await run_mcp_tools(calls[:max_parallel_tool_calls])
+        outputs += [tool_results.error_result(call.tool_name,
+                                              f"skipped, more than {max_parallel_tool_calls} calls in one step")
+                    for call in skipped]
+        return ActionOutput(result="\n\n".join(output.render() for output in outputs), outputs=outputs)
 
     elif act_input.action_type in ["final_answer", "complete_run"]:
         # Get the content from arguments (e.g., answer field)
@@ -45,13 +70,13 @@ def take_action(act_input: ActionInput) -> ActionOutput:
 
 def verify_action_type_from_llm(response: str) -> str:
     """
-    Stub: Use an LLM to determine if the response is a 'final_answer' or 'complete_run'.
-    Return either 'final_answer', 'complete_run', or 'unknown'.
+    Keyword heuristic for whether free text is a final answer ('final_answer'), a completion
+    notice ('complete_run') or neither ('unknown'). Used by the classic agent mode; single-pass
+    mode decides completion from the structured decision instead.
     """
-    # You would replace this with actual LLM verification logic
-    if "task finished" in response.lower():
+    response_lower = response.lower()
+    if "task finished" in response_lower:
         return "complete_run"
-    elif "answer" in response.lower():
+    elif "answer" in response_lower or "summary" in response_lower or "recommendation" in response_lower:
         return "final_answer"
     return "unknown"
-
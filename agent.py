@@ -1,173 +1,354 @@
 # main.py
-import asyncio
-import chainlit as cl
-from perception import perceive, PerceptionInput
+import time
+import logging
+from typing import List, Optional
+from pydantic import BaseModel
+from llm_gateway import track_usage, estimate_tokens
+from perception import perceive_stream, build_prompt, PerceptionInput, PerceptionOutput
 from memory import store_memory, MemoryInput, get_memory
-from decision import make_decision, DecisionInput
-from action import take_action, ActionInput
+from decision import make_decision, detect_action_type, DecisionInput
+from action import take_action, verify_action_type_from_llm, ActionInput, ActionOutput
+from context import ConversationContext, Turn
+from router import route_query
+from tool_catalog import get_catalog
+from semantic_cache import get_semantic_cache
+from telemetry import metrics, span, trace_attributes
+from config import router_enabled, decision_max_repairs, semantic_cache_enabled, agent_mode
 
-# Add this to the top or import from another file
-def verify_action_type_from_llm(response: str) -> str:
-    response_lower = response.lower()
-    if "task finished" in response_lower or "logistics task finished" in response_lower:
-        return "complete_run"
-    elif "answer" in response_lower or "summary" in response_lower or "recommendation" in response_lower:
-        return "final_answer"
-    return "unknown"
+log = logging.getLogger(__name__)
 
-
-def reset_state():
-    """Reset all global variables to their initial state"""
-    global last_response, iteration, iteration_response
-    last_response = None
-    iteration = 0
-    iteration_response = []
-
-async def main(warehouse_location,shipment_volume,automation_level,initial_query):
-    print("Welcome to the Logistics and Warehouse Cognitive Agent! Let's collect your preferences first.")
-    try:
-        preferences = {
-            "warehouse_location": warehouse_location,
-            "shipment_volume": shipment_volume,
-            "automation_level": automation_level
-        }
-
-        store_memory(MemoryInput(key="user_preferences", value=preferences))
-        memory_data = get_memory("user_preferences")
-        
-        system_prompt = f"""You are a logistics and warehouse automation agent specialized in supply chain optimization, inventory control, and efficiency strategies.
-        
-        Warehouse: {memory_data.get("warehouse_location", "unknown")}  
-        Daily Shipments: {memory_data.get("shipment_volume", "unknown")}  
-        Automation: {memory_data.get("automation_level", "unknown")}  
+# Identical for every session and query, so the provider can cache it as the system instruction
+# (see GeminiBackend._cached_system). The warehouse profile and the tools picked for the query
+# travel with the query instead; see session_preamble().
+SYSTEM_PROMPT = """You are a logistics and warehouse automation agent specialized in supply chain optimization, inventory control, and efficiency strategies.
 
                 Respond using ONLY one of these formats:
 
-                FUNCTION_CALL: {{
+                FUNCTION_CALL: {
                 "name": "<tool_name>",
-                "arguments": {{
+                "arguments": {
                     "param1": value1,
                     "param2": value2
-                }}
-                }}  
+                }
+                }  
+                FUNCTION_CALL: [
+                {"name": "<tool_name>", "arguments": {...}},
+                {"name": "<other_tool_name>", "arguments": {...}}
+                ]
                 FINAL_ANSWER: <string>  
                 COMPLETE_RUN
 
-                You can suggest KPIs, route improvements, layout strategies, or take actions using the following tools:
-
-                Logistics & Operations:
-                - suggest_kpis
-                - calculate_storage_utilization(total_capacity: int, used_capacity: int)
-                - optimize_picking_route(zone: str)
-                - layout_optimization(warehouse_size: str)
-                - receiving_process_improvement()
-                - warehouse_safety_checklist()
-                - loading_dock_efficiency()
-                - identify_bottlenecks()
-                - fleet_optimization()
-
-                Inventory Management:
-                - suggest_inventory_kpis()
-                - reorder_threshold(product: str, daily_usage: int, lead_time_days: int)
-                - estimate_restock_time(product: str, current_stock: int, daily_usage: int)
-                - cycle_count_strategy()
-                - forecast_inventory(product: str, season: str)
-                - return_processing_guide()
-
-                Slotting & Packaging:
-                - suggest_slotting_strategy(product_type: str)
-                - packaging_material_advice(product: str)
-
-                Training & Workforce:
-                - employee_training_plan(role: str)
+                You can suggest KPIs, route improvements, layout strategies, or take actions using the tools listed before the query.
 
                 Rules:
                 - All FUNCTION_CALLs MUST be valid JSON. Each must return an object with "name" and "arguments".
                 - If the response includes phrases like "need more information" or "cannot directly answer" or indicates missing input, respond with a new FUNCTION_CALL to request the required data using the tools listed.
                 - Do not generate explanations, summaries, or conclusions outside the FINAL_ANSWER or COMPLETE_RUN format.
                 - If a role like "forklift operator" or "warehouse manager" is mentioned, use employee_training_plan.
+                - If the query needs several independent tools (e.g. KPIs, a safety checklist and a restock estimate), return them together as a JSON list in a single FUNCTION_CALL; they are executed in parallel.
 
                 Additional Instructions:
                 - Self-Check: After selecting a tool or suggesting a strategy, verify that the input parameters are complete and reasonable. If not, respond with a FUNCTION_CALL to gather missing data.
                 - Reasoning Type: For each FUNCTION_CALL, briefly annotate the type of reasoning involved using a comment inside the JSON. For example:
-                FUNCTION_CALL: {{
+                FUNCTION_CALL: {
                     "name": "reorder_threshold",
-                    "arguments": {{
+                    "arguments": {
                     "product": "widget-A",
                     "daily_usage": 50,
                     "lead_time_days": 3
-                    }}                    
-                }}
+                    }                    
+                }
                 - If unsure or conflicted between tools, prefer the one with more direct impact on efficiency, and explain reasoning inside a comment block (inline with JSON if possible).
+"""
+
+
+def session_preamble(memory_data: dict, tool_lines: str) -> str:
+    """The per-session and per-query part of the prompt, sent ahead of the query."""
+    return f"""Warehouse: {memory_data.get("warehouse_location", "unknown")}
+Daily Shipments: {memory_data.get("shipment_volume", "unknown")}
+Automation: {memory_data.get("automation_level", "unknown")}
+
+Tools:
+{tool_lines}"""
+
+
+class AgentResult(BaseModel):
+    answer: Optional[str] = None
+    tool_calls: List[str] = []
+    iterations: int = 0
+    llm_calls: int = 0  # made by the agent process; see tool_llm_calls
+    prompt_tokens: int = 0
+    error: Optional[str] = None
+    cached: bool = False  # answered from the semantic cache
+    tool_result_tokens: int = 0  # tool results as rendered into prompts
+    tool_result_raw_tokens: int = 0  # the same results as str(result.content)
+    tool_llm_calls: int = 0  # made by LLM-backed tools inside the MCP servers
+    mode: str = "classic"
+
+
+def reset_state():
+    """Reset all global variables to their initial state"""
+    global last_response, iteration, iteration_response
+    last_response = None
+    iteration = 0
+    iteration_response = []
+
+async def stream_perception(perception_input: PerceptionInput, on_token=None, answer_only=False) -> PerceptionOutput:
+    """
+    Run perception as a stream, forwarding text to `on_token` as it arrives. With
+    `answer_only`, text is forwarded only once the response is known to be a FINAL_ANSWER.
+    """
+    text = ""
+    action_type = None
+    forwarded = 0
+    async for chunk in perceive_stream(perception_input):
+        text += chunk
+        if on_token is None:
+            continue
+        if not answer_only:
+            await on_token(chunk)
+            continue
+        if action_type is None:
+            action_type = detect_action_type(text)
+        if action_type == "final_answer":
+            answer = text.split("FINAL_ANSWER:", 1)[1].lstrip()
+            if len(answer) > forwarded:
+                await on_token(answer[forwarded:])
+                forwarded = len(answer)
+    return PerceptionOutput(llm_prompt=build_prompt(perception_input), model_response=text.strip())
+
+async def main(warehouse_location,shipment_volume,automation_level,initial_query,session_id="default",
+               on_token=None,on_reset=None,mode=None):
+    """
+    Run the perceive -> decide -> act -> synthesize loop and return an AgentResult whose
+    `answer` is None if no final answer was reached. `on_token` receives answer text as it
+    streams; `on_reset` is called when streamed text turned out not to be final.
+
+    `mode` (default config.agent_mode) is "classic", which synthesizes every tool result with
+    a second LLM call, or "single_pass", which returns prose tool results directly and folds
+    anything else into the next decision prompt.
+    """
+    mode = mode or agent_mode
+    log.info("Starting %s agent run for session %s", mode, session_id)
+    result = AgentResult(mode=mode)
+    usage = track_usage()
+    with trace_attributes(session_id=session_id, mode=mode), span("run") as run_span:
+        await _run(result, warehouse_location, shipment_volume, automation_level, initial_query, session_id,
+                   on_token, on_reset, mode)
+        run_span.update(iterations=result.iterations, prompt_tokens=usage.prompt_tokens,
+                        response_tokens=usage.response_tokens, llm_calls=usage.calls)
+    metrics.inc("agent_runs_total", outcome="error" if result.error else "answered" if result.answer else "unanswered")
+    metrics.observe("agent_llm_calls_per_run", usage.calls, buckets=(1, 2, 3, 4, 6, 8, 12))
+    result.llm_calls = usage.calls
+    result.prompt_tokens = usage.prompt_tokens
+    return result
+
+async def _run(result, warehouse_location, shipment_volume, automation_level, initial_query, session_id,
+               on_token, on_reset, mode):
+    try:
+        preferences = {
+            "warehouse_location": warehouse_location,
+            "shipment_volume": shipment_volume,
+            "automation_level": automation_level
+        }
+
+        store_memory(MemoryInput(session_id=session_id, key="user_preferences", value=preferences))
+        memory_data = await get_memory("user_preferences", session_id=session_id)
+
+        # Reworded repeats of an already answered question skip the loop entirely
+        semantic_cache = get_semantic_cache() if semantic_cache_enabled else None
+        if semantic_cache is not None:
+            with span("semantic_cache") as record:
+                hit = semantic_cache.lookup(initial_query, memory_data)
+                record["cache"] = "hit" if hit else "miss"
+            metrics.inc("cache_requests_total", namespace="semantic", result=record["cache"])
+            if hit is not None:
+                log.info("Answered from the semantic cache (original query: %s)", hit.query)
+                result.answer = hit.answer
+                result.cached = True
+                if on_token is not None:
+                    await on_token(hit.answer)
+                return
+        started = time.perf_counter()
 
-            """
+        # Only the tools relevant to this query are described to the model
+        catalog = await get_catalog()
+        tools = catalog.select(initial_query)
+        tool_lines = "\n".join(tool.render() for tool in tools)
+        metrics.observe("prompt_tools_listed", len(tools), buckets=(2, 4, 8, 16, 32, 64, 128))
+        
+        system_prompt = SYSTEM_PROMPT
+        preamble = session_preamble(memory_data, tool_lines)
 
         #initial_query = input("Please enter your logistics or warehouse query: ")
-        current_query = initial_query
-        #last_response = None
+        context = ConversationContext(system_prompt=system_prompt, query=initial_query, preamble=preamble)
         max_iterations = 3
         iteration = 0
+        last_tool_answer = None
+        # Only answers built entirely from successful steps may be reused for other sessions
+        cacheable = True
 
         while iteration < max_iterations:
-            print(f"\n--- Iteration {iteration + 1} ---")
+            result.iterations = iteration + 1
+            with trace_attributes(iteration=iteration + 1), span("iteration"):
+                # Step 1: Route locally if the query is unambiguous, otherwise run perception
+                perception_input = PerceptionInput(system_prompt=system_prompt, preamble=preamble,
+                                                   user_query=context.render())
+                route = None
+                if router_enabled and iteration == 0:
+                    with span("route") as record:
+                        route = route_query(initial_query)
+                        record.update(tool=route.tool_name, confidence=route.confidence, routed=route.confident)
+                    metrics.inc("router_decisions_total", outcome="routed" if route.confident else "deferred")
+                if route is not None and route.confident:
+                    log.info("Routed locally to %s (confidence %.2f)", route.tool_name, route.confidence)
+                    perception_result = PerceptionOutput(llm_prompt=build_prompt(perception_input),
+                                                         model_response=route.as_function_call())
+                else:
+                    with span("perceive") as record:
+                        record["prompt_tokens"] = context.record_prompt(perception_input)
+                        perception_result = await stream_perception(perception_input, on_token, answer_only=True)
+                        record["response_tokens"] = estimate_tokens(perception_result.model_response)
+
+                log.debug("Prompt sent:\n%s", perception_result.llm_prompt)
+                log.debug("Response:\n%s", perception_result.model_response)
+
+                # Step 2: Make decision; a malformed FUNCTION_CALL gets a targeted repair round-trip
+                with span("decide") as record:
+                    decision = make_decision(DecisionInput(model_response=perception_result.model_response))
+                    record["action_type"] = decision.action_type
+                repairs = 0
+                while decision.action_type == "repair" and repairs < decision_max_repairs:
+                    repairs += 1
+                    log.info("Asking the model to repair its decision: %s", decision.errors)
+                    with span("repair") as record:
+                        repair_input = PerceptionInput(system_prompt=system_prompt, preamble=preamble,
+                                                       user_query=f"{context.render()}\n\n{decision.repair_prompt}")
+                        record["prompt_tokens"] = context.record_prompt(repair_input)
+                        perception_result = await stream_perception(repair_input, on_token, answer_only=True)
+                        decision = make_decision(DecisionInput(model_response=perception_result.model_response))
+                        record["action_type"] = decision.action_type
+                    metrics.inc("decision_repairs_total", result="failed" if decision.action_type == "repair" else "fixed")
 
-            # Step 1: Run perception
-            perception_result = await perceive(PerceptionInput(system_prompt=system_prompt, user_query=current_query))
+                if decision.action_type == "final_answer":
+                    # Already streamed to the user as it arrived, so no synthesis round-trip is needed
+                    log.info("Agent determined completion: FINAL_ANSWER")
+                    result.answer = decision.arguments.get("answer", "")
+                    break
 
-            print("\n--- Gemini Prompt Sent ---")
-            print(perception_result.llm_prompt)
-            print("\n--- Gemini Response ---")
-            print(perception_result.model_response)
+                if mode == "single_pass" and decision.action_type in ("complete_run", "unknown"):
+                    # COMPLETE_RUN ends on the last tool answer; a reply without any prefix is the answer itself
+                    log.info("Agent determined completion: %s", decision.action_type.upper())
+                    result.answer = last_tool_answer if decision.action_type == "complete_run" else \
+                        perception_result.model_response
+                    if result.answer and on_token is not None:
+                        await on_token(result.answer)
+                    break
 
-            # Step 2: Make decision
-            decision = make_decision(DecisionInput(model_response=perception_result.model_response))
+                # Step 3: Take action
+                if decision.action_type == "repair":
+                    # Still unusable after repair; let synthesis answer from what was perceived
+                    cacheable = False
+                    action = ActionOutput(result="[Decision Error] " + "; ".join(decision.errors))
+                else:
+                    with span("act", tool=",".join(call.tool_name for call in decision.tool_calls)):
+                        action = await take_action(ActionInput(
+                            action_type=decision.action_type,
+                            tool_name=decision.tool_name,
+                            arguments=decision.arguments,
+                            tool_calls=decision.tool_calls
+                        ))
 
-            # Step 3: Take action
-            action = take_action(ActionInput(
-                action_type=decision.action_type,
-                tool_name=decision.tool_name,
-                arguments=decision.arguments
-            ))
+                log.debug("Agent output:\n%s", action.result)
+                if not all(output.ok for output in action.outputs):
+                    cacheable = False
+                for output in action.outputs:
+                    result.tool_result_tokens += output.tokens()
+                    result.tool_result_raw_tokens += output.raw_tokens()
+                    result.tool_llm_calls += output.llm_calls
+                # Tools the model chose, even if their arguments never validated
+                result.tool_calls += [call.tool_name for call in decision.tool_calls]
 
-            print("\nAgent Output:", action.result)
+                if mode == "single_pass":
+                    # LLM-backed tools already answer in prose: hand that back without a synthesis call.
+                    # Errors and structured data (calculations) go into the next decision prompt instead.
+                    if action.outputs and all(output.ok and not output.structured for output in action.outputs):
+                        result.answer = "\n\n".join(output.text for output in action.outputs)
+                        log.info("Agent determined completion: TOOL_RESULT")
+                        if on_token is not None:
+                            await on_token(result.answer)
+                        break
+                    # A step with no successful output (failed call, repair) keeps the earlier answer
+                    answered = "\n\n".join(output.text for output in action.outputs if output.ok)
+                    if answered:
+                        last_tool_answer = answered
+                    context.add_turn(Turn(
+                        iteration=iteration + 1,
+                        perception=perception_result.model_response,
+                        decision=" ".join([decision.action_type] + [call.tool_name for call in decision.tool_calls]),
+                        action=action.result,
+                    ))
+                    iteration += 1
+                    continue
 
-            # Step 4: Combine perception and action outputs
-            combined_prompt = f"""
-            You are a cognitive agent that first perceives input and then takes an action based on the perception.
+                # Step 4: Combine perception and action outputs
+                combined_prompt = f"""
+                You are a cognitive agent that first perceives input and then takes an action based on the perception.
 
-            Here is what was perceived:
-            {perception_result.model_response}
+                Here is what was perceived:
+                {perception_result.model_response}
 
-            Here is the action that was taken as a result:
-            {action.result}
+                Here is the action that was taken as a result (one entry per tool call):
+                {context.fit(action.result)}
 
-            Based on both the perception and the action result, synthesize a final answer that is helpful, complete, and user-facing. Do not repeat the steps. Provide a clear and final response.
-            """
-            # Step 5: Send combined prompt to LLM
-            final_result = asyncio.run(perceive(PerceptionInput(system_prompt=system_prompt, user_query=combined_prompt)))
+                Based on both the perception and the action result, synthesize a final answer that is helpful, complete, and user-facing. Do not repeat the steps. Provide a clear and final response.
+                """
+                # Step 5: Send combined prompt to LLM
+                with span("synthesize") as record:
+                    synthesis_input = PerceptionInput(system_prompt=system_prompt, preamble=preamble,
+                                                       user_query=combined_prompt)
+                    record["prompt_tokens"] = context.record_prompt(synthesis_input)
+                    final_result = await stream_perception(synthesis_input, on_token)
+                    record["response_tokens"] = estimate_tokens(final_result.model_response)
 
-            print("\n--- Final LLM Prompt Sent ---")
-            print(final_result.llm_prompt)
-            print("\n--- Final LLM Response ---")
-            print(final_result.model_response)
+                log.debug("Synthesis prompt sent:\n%s", final_result.llm_prompt)
+                log.debug("Synthesis response:\n%s", final_result.model_response)
 
-            # Use LLM-style verification to decide if we're done
-            verified_type = verify_action_type_from_llm(final_result.model_response)
+                # Use LLM-style verification to decide if we're done
+                verified_type = verify_action_type_from_llm(final_result.model_response)
 
-            if verified_type in ["final_answer", "complete_run"]:
-                print(f"\n[Agent Determined Completion: {verified_type.upper()}]")
-                await cl.Message(content=final_result.model_response).send() 
-                break
-                
+                if verified_type in ["final_answer", "complete_run"]:
+                    log.info("Agent determined completion: %s", verified_type.upper())
+                    result.answer = final_result.model_response
+                    break
 
-            # Prepare for next iteration
+                if on_reset is not None:
+                    await on_reset()
+
+                # Prepare for next iteration
+                context.add_turn(Turn(
+                    iteration=iteration + 1,
+                    perception=perception_result.model_response,
+                    decision=" ".join([decision.action_type] + [call.tool_name for call in decision.tool_calls]),
+                    action=action.result,
+                    synthesis=final_result.model_response,
+                ))
             iteration += 1
-            #last_response = final_result.model_response
-            current_query += "\n\n" + final_result.model_response + "\nWhat should I do next?"
+
+        if mode == "single_pass" and result.answer is None and last_tool_answer:
+            # Out of iterations: the last successful tool output is still better than nothing,
+            # but not good enough to serve to anyone else
+            cacheable = False
+            result.answer = last_tool_answer
+            if on_token is not None:
+                await on_token(result.answer)
+
+        log.info("Context: %s", context.metrics())
+        if semantic_cache is not None and result.answer and cacheable:
+            semantic_cache.store(initial_query, memory_data, result.answer, latency_s=time.perf_counter() - started)
 
     except Exception as e:
-        print(f"Error in main execution: {e}")
-        import traceback
-        traceback.print_exc()
+        result.error = str(e)
+        log.exception("Error in main execution: %s", e)
     finally:
-        reset_state()  # Reset at the end of main
\ No newline at end of file
+        reset_state()  # Reset at the end of main
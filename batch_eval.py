@@ -0,0 +1,262 @@
+# batch_eval.py
+# Headless runner: drives agent.main over a question file without Chainlit and reports
+# throughput, latency percentiles, LLM calls per question and tool-selection accuracy.
+#
+#   python batch_eval.py questions.xls --workers 8 --backend fake
+#   python batch_eval.py questions.xls --backend record   # capture real Gemini responses once
+#   python batch_eval.py questions.xls --backend replay   # ...then replay them offline
+import os
+import re
+import csv
+import json
+import time
+import asyncio
+import argparse
+from typing import List, Optional
+from pydantic import BaseModel
+import telemetry
+from bench_mcp_pool import percentile
+
+TOOL_ROW = re.compile(r"^([a-z_][a-z0-9_]*)\s*(\(.*\))?$")
+
+
+class Question(BaseModel):
+    id: str
+    question: str
+    expected_tool: Optional[str] = None
+    category: Optional[str] = None
+
+
+def load_xls(path: str) -> List[Question]:
+    """
+    questions.xls layout: a category row ending in ':', then a tool signature row
+    (e.g. `reorder_threshold(product: str, ...)`) followed by questions for that tool.
+    """
+    import xlrd
+    sheet = xlrd.open_workbook(path).sheet_by_index(0)
+    questions, category, tool = [], None, None
+    for row in range(sheet.nrows):
+        cells = [str(value).strip() for value in sheet.row_values(row) if str(value).strip()]
+        if not cells:
+            continue
+        text = cells[-1].strip('"').strip()
+        match = TOOL_ROW.match(text)
+        if text.endswith(":"):
+            category = text.rstrip(":")
+        elif match:
+            tool = match.group(1)
+        else:
+            questions.append(Question(id=f"row-{row + 1}", question=text, expected_tool=tool, category=category))
+    return questions
+
+
+def load_questions(path: str) -> List[Question]:
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".xls", ".xlsx"):
+        return load_xls(path)
+    with open(path, newline="", encoding="utf-8") as handle:
+        if extension == ".jsonl":
+            rows = [json.loads(line) for line in handle if line.strip()]
+        else:
+            rows = list(csv.DictReader(handle))
+    return [
+        Question(id=str(row.get("id") or index + 1), question=row["question"],
+                 expected_tool=row.get("expected_tool") or None, category=row.get("category") or None)
+        for index, row in enumerate(rows)
+    ]
+
+
+def load_checkpoint(path: str) -> List[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+def llm_calls(record: dict) -> int:
+    return record["llm_calls"] + record.get("tool_llm_calls", 0)
+
+
+def summarize(records: List[dict], wall_seconds: float, ran: Optional[int] = None) -> dict:
+    """`ran` is how many of the records this run produced (default all); only they count for throughput."""
+    ran = len(records) if ran is None else ran
+    latencies = [record["latency_s"] for record in records]
+    graded = [record for record in records if record.get("expected_tool")]
+    answered = [record for record in records if record.get("answer")]
+    return {
+        "questions": len(records),
+        "resumed": len(records) - ran,
+        "answered": len(answered),
+        "errors": sum(1 for record in records if record.get("error")),
+        "semantic_cache_hits": sum(1 for record in records if record.get("cached")),
+        "throughput_per_min": round(ran / wall_seconds * 60, 2) if wall_seconds else 0.0,
+        "latency_p50_s": round(percentile(latencies, 50), 3),
+        "latency_p90_s": round(percentile(latencies, 90), 3),
+        "latency_p99_s": round(percentile(latencies, 99), 3),
+        # Agent calls plus the ones LLM-backed tools make inside the MCP servers
+        "llm_calls_per_question": round(sum(llm_calls(r) for r in records) / len(records), 2) if records else 0.0,
+        "llm_calls_per_answered": round(sum(llm_calls(r) for r in answered) / len(answered), 2) if answered else 0.0,
+        "tool_llm_calls_per_question": round(sum(r.get("tool_llm_calls", 0) for r in records) / len(records), 2)
+        if records else 0.0,
+        "prompt_tokens_per_question": round(sum(r["prompt_tokens"] for r in records) / len(records), 1) if records else 0.0,
+        "tool_selection_accuracy": round(sum(r["tool_correct"] for r in graded) / len(graded), 3) if graded else None,
+        # Tool results as rendered into prompts vs. the old str(result.content) blobs
+        "tool_result_tokens": sum(r.get("tool_result_tokens", 0) for r in records),
+        "tool_result_raw_tokens": sum(r.get("tool_result_raw_tokens", 0) for r in records),
+        "tool_result_reduction": round(1 - sum(r.get("tool_result_tokens", 0) for r in records) /
+                                       sum(r.get("tool_result_raw_tokens", 0) for r in records), 3)
+        if any(r.get("tool_result_raw_tokens") for r in records) else None,
+    }
+
+
+def merge_checkpoint(records: List[dict]) -> dict:
+    """Latest record per question id, except that an error never replaces an earlier success."""
+    merged = {}
+    for record in records:
+        previous = merged.get(record["id"])
+        if previous is None or not record.get("error") or previous.get("error"):
+            merged[record["id"]] = record
+    return merged
+
+
+def write_checkpoint(path: str, records: List[dict]):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as handle:
+        for record in records:
+            handle.write(json.dumps(record) + "\n")
+    os.replace(temp_path, path)
+
+
+def compare_answered(records_by_mode: dict) -> dict:
+    """Per-answered cost of each mode over the questions every mode answered, so the sets match."""
+    common = set.intersection(*({r["id"] for r in records if r.get("answer")} for records in records_by_mode.values()))
+    comparison = {"questions": len(common)}
+    for mode, records in records_by_mode.items():
+        subset = [record for record in records if record["id"] in common]
+        comparison[mode] = {
+            "llm_calls_per_answered": round(sum(llm_calls(r) for r in subset) / len(subset), 2) if subset else 0.0,
+            "prompt_tokens_per_answered": round(sum(r["prompt_tokens"] for r in subset) / len(subset), 1)
+            if subset else 0.0,
+            "latency_p50_s": round(percentile([r["latency_s"] for r in subset], 50), 3),
+        }
+    return comparison
+
+
+async def run_batch(questions: List[Question], args, mode: str, out_path: str) -> tuple:
+    """Returns (records for `questions`, checkpointed ones included, how many of them ran now)."""
+    import agent
+    checkpoint = merge_checkpoint(load_checkpoint(out_path)) if args.resume else {}
+    done = {question_id for question_id, record in checkpoint.items() if not record.get("error")}
+    pending = [question for question in questions if question.id not in done]
+    print(f"[{mode}] {len(pending)} questions to run ({len(done)} already in checkpoint)")
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for question in pending:
+        queue.put_nowait(question)
+    records = []
+
+    with open(out_path, "a" if args.resume else "w", encoding="utf-8") as out:
+        async def worker():
+            while True:
+                try:
+                    question = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                start = time.perf_counter()
+                result = await agent.main(args.location, args.volume, args.automation, question.question,
+                                          session_id=f"batch-{question.id}", mode=mode)
+                record = {
+                    "id": question.id,
+                    "question": question.question,
+                    "expected_tool": question.expected_tool,
+                    "tools": result.tool_calls,
+                    "tool_correct": bool(question.expected_tool and question.expected_tool in result.tool_calls),
+                    "answer": result.answer,
+                    "latency_s": round(time.perf_counter() - start, 4),
+                    "llm_calls": result.llm_calls,
+                    "tool_llm_calls": result.tool_llm_calls,
+                    "prompt_tokens": result.prompt_tokens,
+                    "tool_result_tokens": result.tool_result_tokens,
+                    "tool_result_raw_tokens": result.tool_result_raw_tokens,
+                    "iterations": result.iterations,
+                    "cached": result.cached,
+                    "error": result.error,
+                }
+                records.append(record)
+                # One line per finished question doubles as the resume checkpoint
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+
+        await asyncio.gather(*(worker() for _ in range(args.workers)))
+
+    if not checkpoint:
+        return records, len(records)
+    # Rewrite the checkpoint so retried questions keep one line each
+    merged = merge_checkpoint(list(checkpoint.values()) + records)
+    write_checkpoint(out_path, list(merged.values()))
+    return [merged[question.id] for question in questions if question.id in merged], len(records)
+
+
+def configure_backend(name: str, recording: str):
+    import llm_gateway
+    # The environment reaches the MCP tool servers; set_backend covers this process.
+    os.environ["LLM_BACKEND"] = name
+    os.environ["LLM_RECORDING_PATH"] = recording
+    # Offline backends have no provider quota, so rate limits would only distort the numbers.
+    unlimited = {"requests_per_minute": 0, "tokens_per_minute": 0}
+    if name == "fake":
+        os.environ.update(LLM_REQUESTS_PER_MINUTE="0", LLM_TOKENS_PER_MINUTE="0")
+        llm_gateway.set_backend(llm_gateway.FakeBackend(), **unlimited)
+    elif name == "replay":
+        os.environ.update(LLM_REQUESTS_PER_MINUTE="0", LLM_TOKENS_PER_MINUTE="0")
+        llm_gateway.set_backend(llm_gateway.ReplayBackend(path=recording), **unlimited)
+    elif name == "record":
+        llm_gateway.set_backend(llm_gateway.RecordingBackend(path=recording))
+
+
+async def main(args):
+    from semantic_cache import SemanticCache, set_semantic_cache
+    from mcp_pool import close_pool
+    telemetry.setup()
+    configure_backend(args.backend, args.recording)
+    questions = load_questions(args.questions)
+    if args.limit:
+        questions = questions[:args.limit]
+
+    modes = ["classic", "single_pass"] if args.mode == "both" else [args.mode]
+    summaries, records_by_mode = {}, {}
+    for mode in modes:
+        root, extension = os.path.splitext(args.out)
+        out_path = f"{root}.{mode}{extension}" if len(modes) > 1 else args.out
+        # Each mode starts cold so neither benefits from the other's cached answers, including
+        # the tool responses cached inside the MCP server processes
+        set_semantic_cache(SemanticCache(path=None))
+        await close_pool()
+        start = time.perf_counter()
+        records, ran = await run_batch(questions, args, mode, out_path)
+        summaries[mode] = summarize(records, time.perf_counter() - start, ran)
+        records_by_mode[mode] = records
+    if len(modes) > 1:
+        summaries["same_answered"] = compare_answered(records_by_mode)
+    summary = summaries[modes[0]] if len(modes) == 1 else summaries
+    print(json.dumps(summary, indent=2))
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as handle:
+            json.dump(summary, handle, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the agent over a question file without Chainlit.")
+    parser.add_argument("questions", nargs="?", default="questions.xls", help="xls, csv or jsonl question file")
+    parser.add_argument("--out", default="batch_results.jsonl", help="JSONL results, also used as checkpoint")
+    parser.add_argument("--summary", default=None, help="Optional path for the JSON summary")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--resume", action="store_true", help="Skip questions already answered in --out")
+    parser.add_argument("--limit", type=int, default=0)
+    parser.add_argument("--backend", choices=["gemini", "fake", "record", "replay"], default="fake")
+    parser.add_argument("--recording", default="llm_recording.db", help="Recording file for record/replay")
+    parser.add_argument("--mode", choices=["classic", "single_pass", "both"], default="classic",
+                        help="Agent mode; 'both' runs the questions once per mode and compares them")
+    parser.add_argument("--location", default="Chicago")
+    parser.add_argument("--volume", default="1000")
+    parser.add_argument("--automation", default="medium")
+    asyncio.run(main(parser.parse_args()))
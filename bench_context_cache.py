@@ -0,0 +1,102 @@
+# bench_context_cache.py
+# Checks the Gemini context-cache path against a stub genai client (no network). At the default
+# LLM_CONTEXT_CACHE_MIN_TOKENS the system prompt is too small to cache, so the cached path is
+# exercised with the threshold lowered below its size.
+#
+#   python bench_context_cache.py
+import asyncio
+import argparse
+from types import SimpleNamespace
+import llm_gateway
+from agent import SYSTEM_PROMPT
+from config import llm_context_cache_min_tokens
+
+
+class StubCaches:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.attempts = 0
+        self.created = []
+
+    async def create(self, model, config):
+        self.attempts += 1
+        if self.fail:
+            raise RuntimeError("caching not supported for this model")
+        self.created.append(config.system_instruction)
+        return SimpleNamespace(name=f"cachedContents/{len(self.created)}")
+
+
+class StubModels:
+    def __init__(self):
+        self.configs = []
+
+    async def generate_content(self, model, contents, config):
+        self.configs.append(config)
+        return SimpleNamespace(text="FINAL_ANSWER: ok", usage_metadata=None)
+
+
+def stub_backend(fail: bool = False):
+    backend = llm_gateway.GeminiBackend()
+    client = SimpleNamespace(aio=SimpleNamespace(caches=StubCaches(fail), models=StubModels()))
+    backend.client = lambda: client
+    return backend, client.aio
+
+
+async def generate(backend, system):
+    await backend.generate("Logistics Query: what KPIs should I track?", "gemini-2.0-flash", system=system)
+
+
+async def too_small() -> bool:
+    llm_gateway.llm_context_cache_min_tokens = llm_context_cache_min_tokens
+    backend, aio = stub_backend()
+    await generate(backend, SYSTEM_PROMPT)
+    inline = aio.models.configs[-1].system_instruction == SYSTEM_PROMPT
+    print(f"too_small: prompt={llm_gateway.estimate_tokens(SYSTEM_PROMPT)} tokens "
+          f"min={llm_context_cache_min_tokens} caches created={len(aio.caches.created)} inline={inline}")
+    return not aio.caches.created and inline
+
+
+async def cached() -> bool:
+    llm_gateway.llm_context_cache_min_tokens = 1
+    backend, aio = stub_backend()
+    for _ in range(3):
+        await generate(backend, SYSTEM_PROMPT)
+    names = [config.cached_content for config in aio.models.configs]
+    inline = [config.system_instruction for config in aio.models.configs]
+    print(f"cached: caches created={len(aio.caches.created)} cached_content={names}")
+    return aio.caches.created == [SYSTEM_PROMPT] and names == ["cachedContents/1"] * 3 and not any(inline)
+
+
+async def bounded() -> bool:
+    llm_gateway.llm_context_cache_min_tokens = 1
+    backend, aio = stub_backend()
+    prompts = [f"{SYSTEM_PROMPT}\nVariant {i}" for i in range(llm_gateway.llm_context_cache_max_entries + 2)]
+    for prompt in prompts:
+        await generate(backend, prompt)
+    await generate(backend, prompts[-1])  # still cached
+    print(f"bounded: prompts={len(prompts)} caches created={len(aio.caches.created)} "
+          f"kept={len(backend._context_caches)}")
+    return len(aio.caches.created) == len(prompts) and \
+        len(backend._context_caches) == llm_gateway.llm_context_cache_max_entries
+
+
+async def fallback() -> bool:
+    llm_gateway.llm_context_cache_min_tokens = 1
+    backend, aio = stub_backend(fail=True)
+    await generate(backend, SYSTEM_PROMPT)
+    await generate(backend, SYSTEM_PROMPT)
+    inline = [config.system_instruction == SYSTEM_PROMPT for config in aio.models.configs]
+    print(f"fallback: inline={inline} create attempts={aio.caches.attempts}")
+    return all(inline) and aio.caches.attempts == 1
+
+
+async def main(args):
+    failed = [check.__name__ for check in (too_small, cached, bounded, fallback) if not await check()]
+    if failed:
+        raise SystemExit(f"Context cache checks failed: {', '.join(failed)}")
+    print("OK: small prompts go inline, large ones are cached once, bounded, and fall back inline")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Context-cache checks on a stub Gemini client.")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,122 @@
+# bench_mcp_http.py
+# Tool throughput of `mcp_server.py --transport streamable-http` as the worker count grows.
+# For each worker count the server is started on a free port and driven for a fixed time by
+# several client processes, each an MCPToolPool of keep-alive HTTP sessions.
+#
+#   python bench_mcp_http.py --workers 1 2 4 --clients 4 --seconds 10
+#   python bench_mcp_http.py --tool suggest_kpis --arguments '{}'   # LLM-backed tool on the fake model
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from mcp_pool import MCPToolPool, SERVER_SCRIPT
+from bench_mcp_pool import percentile
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, workers: int) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.setdefault("LLM_BACKEND", "fake")
+    if env["LLM_BACKEND"] == "fake":
+        # No provider quota behind the fake model; the rate limiter would cap the throughput
+        env.update(LLM_REQUESTS_PER_MINUTE="0", LLM_TOKENS_PER_MINUTE="0")
+    # Measure the server, not its response cache (CACHE_TTL_SECONDS=0 misses the per-tool TTLs)
+    env["TOOL_CACHE_ENABLED"] = "0"
+    return subprocess.Popen([sys.executable, SERVER_SCRIPT, "--transport", "streamable-http",
+                             "--port", str(port), "--workers", str(workers)], env=env)
+
+
+def wait_for_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"MCP server did not listen on port {port} within {timeout:g}s")
+
+
+def tool_arguments(args) -> dict:
+    if args.arguments is not None:
+        return json.loads(args.arguments)
+    # Fresh numbers per call so nothing can be served from a cache
+    total = random.randint(1_000, 100_000)
+    return {"total_capacity": total, "used_capacity": random.randint(0, total)}
+
+
+async def drive(url: str, args) -> list:
+    pool = MCPToolPool(url, size=args.sessions, max_in_flight=args.concurrency, health_interval=0)
+    await pool.start()
+    latencies = []
+    stop = time.monotonic() + args.seconds
+
+    async def caller():
+        while time.monotonic() < stop:
+            start = time.perf_counter()
+            result = await pool.call_tool(args.tool, tool_arguments(args))
+            if getattr(result, "isError", False):
+                raise RuntimeError(f"{args.tool} failed: {result.content}")
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(caller() for _ in range(args.concurrency)))
+    await pool.close()
+    return latencies
+
+
+def client_process(url: str, args) -> list:
+    return asyncio.run(drive(url, args))
+
+
+def measure(workers: int, args) -> dict:
+    port = free_port()
+    server = start_server(port, workers)
+    try:
+        wait_for_port(port)
+        url = f"http://127.0.0.1:{port}/mcp"
+        with ProcessPoolExecutor(args.clients) as executor:
+            start = time.perf_counter()
+            latencies = [latency for batch in executor.map(client_process, [url] * args.clients,
+                                                             [args] * args.clients) for latency in batch]
+            wall = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    return {
+        "workers": workers,
+        "calls": len(latencies),
+        "calls_per_s": len(latencies) / wall,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the streamable HTTP MCP server across worker counts.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=4, help="Client processes generating load")
+    parser.add_argument("--sessions", type=int, default=4, help="Keep-alive MCP sessions per client process")
+    parser.add_argument("--concurrency", type=int, default=16, help="Calls in flight per client process")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--tool", default="calculate_storage_utilization")
+    parser.add_argument("--arguments", default=None, help="Fixed JSON arguments; default varies the numbers")
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs; the server workers and client processes share them")
+    baseline = None
+    for workers in args.workers:
+        report = measure(workers, args)
+        baseline = baseline or report["calls_per_s"]
+        print(f"workers={workers:2d} calls={report['calls']:6d} {report['calls_per_s']:8.1f} calls/s "
+              f"({report['calls_per_s'] / baseline:4.2f}x) p50={report['p50_ms']:7.1f}ms p99={report['p99_ms']:7.1f}ms")
@@ -0,0 +1,74 @@
+# bench_mcp_pool.py
+# Compares per-call latency of spawning mcp_server.py for every call against the pooled sessions.
+#
+#   python bench_mcp_pool.py --calls 50 --concurrency 4
+#   python bench_mcp_pool.py --tool suggest_kpis        # real tool call (hits Gemini)
+import json
+import time
+import asyncio
+import argparse
+from mcp.client.stdio import stdio_client
+from mcp import ClientSession
+from mcp_pool import MCPToolPool, default_server_params
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def spawn_per_call(tool_name, arguments):
+    # The original action.call_mcp_tool behaviour: new process + initialize handshake every time.
+    async with stdio_client(default_server_params()) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            if tool_name:
+                return await session.call_tool(tool_name, arguments)
+            return await session.list_tools()
+
+
+async def run(label, call, calls, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(calls)))
+    wall = time.perf_counter() - start
+    print(f"{label:>14}: calls={calls} p50={percentile(latencies, 50):8.1f}ms "
+          f"p99={percentile(latencies, 99):8.1f}ms wall={wall:6.2f}s")
+
+
+async def main(args):
+    arguments = json.loads(args.arguments)
+    await run("spawn-per-call", lambda: spawn_per_call(args.tool, arguments), args.calls, args.concurrency)
+
+    pool = MCPToolPool(size=args.pool_size, max_in_flight=args.concurrency)
+    start = time.perf_counter()
+    await pool.start()
+    print(f"{'pool warmup':>14}: {(time.perf_counter() - start) * 1000:.1f}ms for {args.pool_size} servers")
+    if args.tool:
+        await run("pooled", lambda: pool.call_tool(args.tool, arguments), args.calls, args.concurrency)
+    else:
+        await run("pooled", pool.list_tools, args.calls, args.concurrency)
+    print("pool stats:", pool.stats())
+    await pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark MCP tool call latency.")
+    parser.add_argument("--calls", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--tool", type=str, default=None, help="Tool to call; defaults to a list_tools round-trip")
+    parser.add_argument("--arguments", type=str, default="{}", help="JSON arguments for --tool")
+    args = parser.parse_args()
+    asyncio.run(main(args))
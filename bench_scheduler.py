@@ -0,0 +1,133 @@
+# bench_scheduler.py
+# Exercises scheduler.py against the fake LLM backend (no Gemini, no MCP servers):
+#   fairness  - one session floods the queue while others send a single query each
+#   shedding  - a burst larger than the queue gets fast "busy" replies
+#   deadline  - runs slower than their deadline are cancelled and free their LLM slots
+#   quota     - a 429 from the model shrinks capacity for the cooldown and sheds new work
+#
+#   python bench_scheduler.py
+#   python bench_scheduler.py --latency 0.05 --hog 30
+import time
+import asyncio
+import argparse
+import agent
+import perception
+import llm_gateway
+from action import ActionOutput
+from tool_catalog import catalog_from_source
+from scheduler import Scheduler, SchedulerBusy, DeadlineExceeded
+from bench_mcp_pool import percentile
+
+# Fake traffic must not touch the shared rate-limit file real agents on this host draw from
+UNLIMITED = {"requests_per_minute": 0, "tokens_per_minute": 0}
+
+
+class QuotaError(Exception):
+    code = 429
+
+
+class QuotaBackend(llm_gateway.FakeBackend):
+    """Fake model that answers 429 to its first `failures` calls."""
+
+    def __init__(self, failures: int, latency: float):
+        super().__init__(latency=latency)
+        self.failures = failures
+
+    async def generate(self, prompt, model, system=None):
+        if self.failures > 0:
+            self.failures -= 1
+            raise QuotaError("429 RESOURCE_EXHAUSTED")
+        return await super().generate(prompt, model, system)
+
+
+async def stub_take_action(act_input):
+    await asyncio.sleep(0.01)
+    return ActionOutput(result=f"[MCP Response] stub result for {act_input.tool_name}")
+
+
+async def stub_get_catalog():
+    return catalog_from_source()
+
+
+def ask(session_id: str, query: str = "What KPIs should I track for my warehouse?"):
+    return lambda: agent.main("Chicago", "500", "medium", query, session_id=session_id)
+
+
+async def timed(scheduler: Scheduler, session_id: str, deadline=None):
+    start = time.perf_counter()
+    try:
+        await scheduler.run(session_id, ask(session_id), deadline=deadline)
+        outcome = "ok"
+    except SchedulerBusy as e:
+        outcome = f"busy:{e.reason}"
+    except DeadlineExceeded as e:
+        outcome = f"deadline:{e.stage}"
+    return outcome, time.perf_counter() - start
+
+
+async def fairness(args) -> bool:
+    scheduler = Scheduler(max_concurrency=2, per_session=1, max_queue=100, max_session_pending=100, deadline=0)
+    hog = [asyncio.create_task(timed(scheduler, "hog")) for _ in range(args.hog)]
+    await asyncio.sleep(0)
+    others = [asyncio.create_task(timed(scheduler, f"user-{i}")) for i in range(4)]
+    hog_latency = [latency for _, latency in await asyncio.gather(*hog)]
+    other_latency = [latency for _, latency in await asyncio.gather(*others)]
+    print(f"fairness: hog p50={percentile(hog_latency, 50):.3f}s max={max(hog_latency):.3f}s  "
+          f"others max={max(other_latency):.3f}s")
+    return max(other_latency) < max(hog_latency) / 2
+
+
+async def shedding(args) -> bool:
+    scheduler = Scheduler(max_concurrency=4, per_session=1, max_queue=10, max_session_pending=4, deadline=0)
+    results = await asyncio.gather(*(timed(scheduler, f"burst-{i}") for i in range(args.burst)))
+    shed = [latency for outcome, latency in results if outcome.startswith("busy")]
+    served = [latency for outcome, latency in results if outcome == "ok"]
+    print(f"shedding: served={len(served)} shed={len(shed)} shed p99={percentile(shed, 99) * 1000:.1f}ms "
+          f"served p99={percentile(served, 99) * 1000:.1f}ms  metrics={scheduler.stats()}")
+    return len(served) == 14 and bool(shed) and percentile(shed, 99) < 0.05
+
+
+async def deadline(args) -> bool:
+    llm_gateway.set_backend(llm_gateway.FakeBackend(latency=args.latency * 10), **UNLIMITED)
+    scheduler = Scheduler(max_concurrency=4, deadline=args.latency * 3)
+    results = await asyncio.gather(*(timed(scheduler, f"slow-{i}") for i in range(4)))
+    # Cancelled runs must give their LLM slots back
+    in_flight = llm_gateway.get_gateway().stats()["in_flight"]
+    print(f"deadline: outcomes={[outcome for outcome, _ in results]} "
+          f"max={max(latency for _, latency in results):.3f}s llm calls in flight={in_flight}")
+    return all(outcome == "deadline:running" for outcome, _ in results) and \
+        max(latency for _, latency in results) < args.latency * 5 and in_flight == 0
+
+
+async def quota(args) -> bool:
+    llm_gateway.set_backend(QuotaBackend(failures=1, latency=args.latency), **UNLIMITED, max_retries=0)
+    scheduler = Scheduler(max_concurrency=8, cooldown_concurrency=1, quota_cooldown=5, deadline=args.latency * 20)
+    first, _ = await timed(scheduler, "first")
+    capacity = scheduler.capacity()
+    await timed(scheduler, "second")  # succeeds and gives the scheduler a run time to estimate with
+    results = await asyncio.gather(*(timed(scheduler, f"after-{i}") for i in range(40)))
+    outcomes = [outcome for outcome, _ in results]
+    print(f"quota: first={first} capacity during cooldown={capacity} "
+          f"served={outcomes.count('ok')} shed={sum(o.startswith('busy:quota') for o in outcomes)}")
+    return capacity == 1 and "busy:quota" in outcomes
+
+
+async def main(args):
+    agent.take_action = stub_take_action
+    agent.get_catalog = stub_get_catalog
+    agent.semantic_cache_enabled = False
+    perception.perception_cache_ttl = 0  # every run must reach the (fake) model
+    llm_gateway.set_backend(llm_gateway.FakeBackend(latency=args.latency), **UNLIMITED)
+
+    failed = [check.__name__ for check in (fairness, shedding, deadline, quota) if not await check(args)]
+    if failed:
+        raise SystemExit(f"Scheduler checks failed: {', '.join(failed)}")
+    print("OK: fair, sheds fast, enforces deadlines and backs off on quota")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scheduler behaviour checks on the fake LLM backend.")
+    parser.add_argument("--latency", type=float, default=0.02, help="Fake LLM latency per call in seconds")
+    parser.add_argument("--hog", type=int, default=20, help="Queries the flooding session sends")
+    parser.add_argument("--burst", type=int, default=50, help="Concurrent sessions in the shedding check")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,68 @@
+# bench_sessions.py
+# Runs many agent sessions side by side in one event loop against stub LLM/tool backends
+# and checks that wall-clock time stays close to a single session instead of growing linearly.
+#
+#   python bench_sessions.py --sessions 50
+import time
+import asyncio
+import argparse
+import agent
+from action import ActionOutput
+from tool_catalog import catalog_from_source
+
+LLM_LATENCY = 0.05
+TOOL_LATENCY = 0.05
+
+
+async def stub_perceive_stream(input_data):
+    await asyncio.sleep(LLM_LATENCY)
+    if "Here is the action that was taken" in input_data.user_query:
+        yield "Here is the answer "
+        yield "you asked for."
+    else:
+        yield 'FUNCTION_CALL: {"name": "suggest_kpis", "arguments": {}}'
+
+
+async def stub_take_action(act_input):
+    await asyncio.sleep(TOOL_LATENCY)
+    return ActionOutput(result=f"[MCP Response] stub result for {act_input.tool_name}")
+
+
+async def stub_get_catalog():
+    # list_tools would start real MCP servers and put their startup into the baseline
+    return catalog_from_source()
+
+
+async def run_sessions(count):
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        agent.main("Chicago", "500", "medium", f"What KPIs should I track? (session {i})")
+        for i in range(count)
+    ))
+    return time.perf_counter() - start
+
+
+async def main(args):
+    agent.perceive_stream = stub_perceive_stream
+    agent.take_action = stub_take_action
+    agent.get_catalog = stub_get_catalog
+    # The local router would answer the KPI query without the stubbed first LLM call
+    agent.router_enabled = False
+    # Every session must run the loop; this also keeps semantic_cache.json out of the working directory
+    agent.semantic_cache_enabled = False
+
+    single = await run_sessions(1)
+    many = await run_sessions(args.sessions)
+    ratio = many / single
+    print(f"1 session: {single:.3f}s  {args.sessions} sessions: {many:.3f}s  ratio: {ratio:.2f}x")
+    if ratio > args.max_ratio:
+        raise SystemExit(f"Sessions are being serialized: {ratio:.2f}x > {args.max_ratio}x")
+    print("OK: sessions ran concurrently")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent agent session scaling check.")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--max-ratio", type=float, default=3.0,
+                        help="Fail if N sessions take more than this multiple of one session")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,188 @@
+# cache.py
+import json
+import time
+import sqlite3
+import hashlib
+import inspect
+import functools
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, Optional
+from pydantic_core import to_jsonable_python
+from telemetry import metrics
+from config import llm, cache_max_entries, cache_default_ttl, cache_sqlite_path, tool_cache_ttl, tool_cache_enabled
+
+
+def normalize_arguments(value: Any) -> Any:
+    # "Widget-A " and "widget-a" should share an entry; key order must not matter.
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    if isinstance(value, dict):
+        return {str(k): normalize_arguments(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple)):
+        return [normalize_arguments(v) for v in value]
+    return value
+
+
+# Keyed on prompt text, which is hashed verbatim: case and spacing can change what the model answers.
+RAW_NAMESPACES = {"prompt", "recording"}
+
+
+def make_key(namespace: str, name: str, arguments: dict, model: str = llm) -> str:
+    args = arguments if namespace in RAW_NAMESPACES else normalize_arguments(arguments)
+    payload = json.dumps(
+        {"ns": namespace, "name": name, "args": args, "model": model},
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class TTLCache:
+    """In-memory LRU where every entry also carries its own expiry time."""
+
+    def __init__(self, max_entries: int = cache_max_entries):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteStore:
+    """Optional on-disk layer so cached responses survive restarts; values are stored as JSON."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        # WAL lets the agent and every MCP server process share one cache file.
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[tuple]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value: Any, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at),
+            )
+            self._conn.commit()
+
+
+class ResponseCache:
+    """
+    Two-level cache for LLM-backed responses, keyed on namespace + name + arguments
+    (normalized, except prompt text) + model. Memory is checked first, then the optional SQLite store.
+    """
+
+    def __init__(self, max_entries: int = cache_max_entries, sqlite_path: Optional[str] = cache_sqlite_path):
+        self.memory = TTLCache(max_entries)
+        self.store = SQLiteStore(sqlite_path) if sqlite_path else None
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+
+    def get(self, namespace: str, name: str, arguments: dict, model: str = llm) -> Optional[Any]:
+        key = make_key(namespace, name, arguments, model)
+        value = self.memory.get(key)
+        if value is None and self.store is not None:
+            stored = self.store.get(key)
+            if stored is not None:
+                value, expires_at = stored
+                self.memory.set(key, value, expires_at - time.time())
+        if value is None:
+            self.misses[name] += 1
+        else:
+            self.hits[name] += 1
+        metrics.inc("cache_requests_total", namespace=namespace, result="miss" if value is None else "hit")
+        return value
+
+    def set(self, namespace: str, name: str, arguments: dict, value: Any, ttl: float = cache_default_ttl,
+            model: str = llm):
+        if ttl <= 0:
+            return
+        key = make_key(namespace, name, arguments, model)
+        value = to_jsonable_python(value)
+        self.memory.set(key, value, ttl)
+        if self.store is not None:
+            self.store.set(key, value, time.time() + ttl)
+
+    def stats(self) -> dict:
+        names = sorted(set(self.hits) | set(self.misses))
+        return {
+            "entries": len(self.memory),
+            "per_name": {name: {"hits": self.hits[name], "misses": self.misses[name]} for name in names},
+            "hits": sum(self.hits.values()),
+            "misses": sum(self.misses.values()),
+        }
+
+
+def tool_ttl(tool_name: str) -> float:
+    if not tool_cache_enabled:
+        return 0.0
+    return tool_cache_ttl.get(tool_name, cache_default_ttl)
+
+
+_cache: Optional[ResponseCache] = None
+
+
+def get_cache() -> ResponseCache:
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache()
+    return _cache
+
+
+def cached_tool(fn):
+    """
+    Cache an async MCP tool on its name and bound arguments, using the per-tool TTL from
+    config.tool_cache_ttl. Apply it below @mcp.tool() so FastMCP still sees the real signature.
+    """
+    signature = inspect.signature(fn)
+    ttl = tool_ttl(fn.__name__)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if ttl <= 0:
+            return await fn(*args, **kwargs)
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        cache = get_cache()
+        hit = cache.get("tool", fn.__name__, arguments)
+        if hit is not None:
+            return hit
+        result = await fn(*args, **kwargs)
+        cache.set("tool", fn.__name__, arguments, result, ttl=ttl)
+        return result
+
+    return wrapper
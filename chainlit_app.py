@@ -2,7 +2,12 @@
 
 import chainlit as cl
 import os
+import math
+import telemetry
 from agent import main
+from scheduler import get_scheduler, SchedulerBusy, DeadlineExceeded
+
+telemetry.setup()
 
 @cl.on_chat_start
 async def on_chat_start():
@@ -33,10 +38,38 @@ async def handle_message(message: cl.Message):
     shipment_volume = cl.user_session.get("shipment_volume")
     automation_level = cl.user_session.get("automation_level")
 
-    # Run agent
-    await main(
-        warehouse_location=warehouse_location,
-        shipment_volume=shipment_volume,
-        automation_level=automation_level,
-        initial_query=message.content,
-    )
+    # Stream the answer into the UI as it is generated
+    msg = cl.Message(content="")
+
+    async def on_token(token):
+        await msg.stream_token(token)
+
+    async def on_reset():
+        # The streamed text was an intermediate step, not the final answer
+        nonlocal msg
+        await msg.remove()
+        msg = cl.Message(content="")
+
+    # Run agent through the scheduler: fair queueing across sessions, a deadline and load shedding
+    session_id = cl.user_session.get("id")
+    try:
+        result = await get_scheduler().run(session_id, lambda: main(
+            warehouse_location=warehouse_location,
+            shipment_volume=shipment_volume,
+            automation_level=automation_level,
+            initial_query=message.content,
+            session_id=session_id,
+            on_token=on_token,
+            on_reset=on_reset,
+        ))
+    except SchedulerBusy as e:
+        wait = f" in about {math.ceil(e.retry_after)}s" if e.retry_after >= 1 else " shortly"
+        await cl.Message(content=f"⏳ The agent is busy right now, please try again{wait}.").send()
+        return
+    except DeadlineExceeded:
+        await msg.remove()
+        await cl.Message(content="⌛ That took too long and was stopped. Try a narrower question.").send()
+        return
+    if result.answer:
+        msg.content = result.answer
+        await msg.send()
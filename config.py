@@ -1 +1,122 @@
-llm="gemini-2.0-flash"
\ No newline at end of file
+import os
+
+llm="gemini-2.0-flash"
+
+# MCP tool server pool
+mcp_pool_size = int(os.getenv("MCP_POOL_SIZE", "2"))
+mcp_max_in_flight = int(os.getenv("MCP_MAX_IN_FLIGHT", "8"))
+mcp_call_timeout = float(os.getenv("MCP_CALL_TIMEOUT", "60"))
+mcp_health_interval = float(os.getenv("MCP_HEALTH_INTERVAL", "30"))
+# e.g. http://127.0.0.1:8000/mcp to use a running `mcp_server.py --transport streamable-http`
+# instead of spawning stdio servers; the pool then holds that many keep-alive HTTP sessions
+mcp_server_url = os.getenv("MCP_SERVER_URL")
+
+# LLM gateway; 0 disables a limit
+llm_backend = os.getenv("LLM_BACKEND", "gemini")
+llm_max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+llm_requests_per_minute = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "60"))
+llm_tokens_per_minute = float(os.getenv("LLM_TOKENS_PER_MINUTE", "1000000"))
+llm_max_retries = int(os.getenv("LLM_MAX_RETRIES", "3"))
+# The per-minute limits are shared through this SQLite file by the agent and the MCP servers it spawns
+# (and anything else on the host pointing at it); empty gives every process the full limits
+llm_rate_limit_path = os.getenv("LLM_RATE_LIMIT_PATH", "llm_rate_limit.db")
+llm_recording_path = os.getenv("LLM_RECORDING_PATH", "llm_recording.db")  # for LLM_BACKEND=record/replay
+
+# Response cache for MCP tools and repeated prompts
+cache_max_entries = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+cache_default_ttl = float(os.getenv("CACHE_TTL_SECONDS", "3600"))
+cache_sqlite_path = os.getenv("CACHE_SQLITE_PATH")  # unset keeps the cache in memory only
+perception_cache_ttl = float(os.getenv("PERCEPTION_CACHE_TTL_SECONDS", "600"))
+tool_cache_enabled = os.getenv("TOOL_CACHE_ENABLED", "1") == "1"  # 0 turns off every tool TTL below
+# Per-tool TTL in seconds; tools not listed use cache_default_ttl and 0 disables caching
+tool_cache_ttl = {
+    "suggest_kpis": 86400,
+    "suggest_inventory_kpis": 86400,
+    "warehouse_safety_checklist": 86400,
+    "receiving_process_improvement": 86400,
+    "return_processing_guide": 86400,
+    "loading_dock_efficiency": 86400,
+    "cycle_count_strategy": 86400,
+    "identify_bottlenecks": 86400,
+    "fleet_optimization": 86400,
+    "packaging_material_advice": 86400,
+    "employee_training_plan": 86400,
+    "forecast_inventory": 3600,
+}
+
+# Context management for the iterative query
+context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+context_recent_turns = int(os.getenv("CONTEXT_RECENT_TURNS", "1"))
+context_summary_chars = int(os.getenv("CONTEXT_SUMMARY_CHARS", "300"))
+llm_context_cache = os.getenv("LLM_CONTEXT_CACHE", "1") == "1"
+llm_context_cache_min_tokens = int(os.getenv("LLM_CONTEXT_CACHE_MIN_TOKENS", "4096"))
+llm_context_cache_ttl = float(os.getenv("LLM_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+llm_context_cache_max_entries = int(os.getenv("LLM_CONTEXT_CACHE_MAX_ENTRIES", "8"))  # distinct system prompts kept
+
+# Session memory: "memory", "sqlite" or "redis" (any Redis-compatible server)
+memory_backend = os.getenv("MEMORY_BACKEND", "memory")
+memory_sqlite_path = os.getenv("MEMORY_SQLITE_PATH", "memory.db")
+memory_redis_url = os.getenv("MEMORY_REDIS_URL", "redis://localhost:6379/0")
+memory_max_sessions = int(os.getenv("MEMORY_MAX_SESSIONS", "10000"))
+memory_idle_ttl = float(os.getenv("MEMORY_IDLE_TTL_SECONDS", "86400"))
+memory_flush_batch = int(os.getenv("MEMORY_FLUSH_BATCH", "32"))
+memory_flush_interval = float(os.getenv("MEMORY_FLUSH_INTERVAL_SECONDS", "2"))
+
+# Tool calls requested together in one FUNCTION_CALL run concurrently
+tool_call_timeout = float(os.getenv("TOOL_CALL_TIMEOUT", "45"))
+max_parallel_tool_calls = int(os.getenv("MAX_PARALLEL_TOOL_CALLS", "5"))
+
+# Observability; unset values disable the exporter/profiler
+log_level = os.getenv("LOG_LEVEL", "INFO").upper()  # DEBUG also logs full prompts and responses
+metrics_port = int(os.getenv("METRICS_PORT", "0"))  # Prometheus text format on /metrics
+metrics_file = os.getenv("METRICS_FILE")  # JSON dump of all metrics at exit
+trace_file = os.getenv("TRACE_FILE")  # JSONL, one line per finished span
+profile_file = os.getenv("PROFILE_FILE")  # collapsed stacks from the sampling profiler
+profile_interval = float(os.getenv("PROFILE_INTERVAL_SECONDS", "0.005"))
+
+# Local intent router in front of the first perception call; below the threshold the LLM decides
+router_enabled = os.getenv("ROUTER_ENABLED", "1") == "1"
+router_min_confidence = float(os.getenv("ROUTER_MIN_CONFIDENCE", "0.8"))
+
+# Malformed or invalid FUNCTION_CALLs get this many targeted repair prompts before giving up
+decision_max_repairs = int(os.getenv("DECISION_MAX_REPAIRS", "1"))
+
+# Tool catalog from MCP list_tools; only the top-k tools for the query go into the system prompt (0 = all)
+tool_catalog_ttl = float(os.getenv("TOOL_CATALOG_TTL_SECONDS", "3600"))
+tool_catalog_retry = float(os.getenv("TOOL_CATALOG_RETRY_SECONDS", "30"))  # how long a fallback catalog is kept
+tool_top_k = int(os.getenv("TOOL_TOP_K", "5"))
+
+# Semantic answer cache in front of agent.main; an unset path keeps it in memory only
+semantic_cache_enabled = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+semantic_cache_path = os.getenv("SEMANTIC_CACHE_PATH", "semantic_cache.json")
+semantic_cache_threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.85"))
+semantic_cache_max_entries = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+semantic_cache_dim = int(os.getenv("SEMANTIC_CACHE_DIM", "512"))
+semantic_cache_ttl = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "86400"))  # 0 keeps answers forever
+semantic_cache_snapshot_every = int(os.getenv("SEMANTIC_CACHE_SNAPSHOT_EVERY", "20"))  # writes between snapshots
+semantic_cache_refresh_interval = float(os.getenv("SEMANTIC_CACHE_REFRESH_SECONDS", "2"))  # snapshot file checks
+
+# "classic": perceive, act, then a synthesis LLM call per iteration; "single_pass": tool prose is
+# returned as the answer and other tool results are folded into the next decision prompt
+agent_mode = os.getenv("AGENT_MODE", "classic")
+
+# Request scheduler between Chainlit and agent.main; a deadline of 0 disables it
+scheduler_max_concurrency = int(os.getenv("SCHEDULER_MAX_CONCURRENCY", "8"))
+scheduler_per_session = int(os.getenv("SCHEDULER_PER_SESSION", "1"))  # runs at once per session
+scheduler_max_queue = int(os.getenv("SCHEDULER_MAX_QUEUE", "64"))
+scheduler_max_session_pending = int(os.getenv("SCHEDULER_MAX_SESSION_PENDING", "4"))  # queued + running
+scheduler_deadline = float(os.getenv("SCHEDULER_DEADLINE_SECONDS", "120"))
+# After a Gemini 429, admit at most this many runs at once for the cooldown period
+scheduler_quota_cooldown = float(os.getenv("SCHEDULER_QUOTA_COOLDOWN_SECONDS", "30"))
+scheduler_cooldown_concurrency = int(os.getenv("SCHEDULER_COOLDOWN_CONCURRENCY", "2"))
+
+# Tool results: hard caps on each field as results arrive, then a per-result token budget when they
+# are rendered into a prompt; oversized text is cut by the policy ("truncate", "head_tail" or
+# "summarize", which keeps the first sentence of each paragraph or list item)
+tool_result_max_text_tokens = int(os.getenv("TOOL_RESULT_MAX_TEXT_TOKENS", "4000"))
+tool_result_max_numbers = int(os.getenv("TOOL_RESULT_MAX_NUMBERS", "64"))
+tool_result_max_table_rows = int(os.getenv("TOOL_RESULT_MAX_TABLE_ROWS", "500"))
+tool_result_max_cell_chars = int(os.getenv("TOOL_RESULT_MAX_CELL_CHARS", "60"))
+tool_result_prompt_tokens = int(os.getenv("TOOL_RESULT_PROMPT_TOKENS", "800"))  # 0 = no budget
+tool_result_prompt_rows = int(os.getenv("TOOL_RESULT_PROMPT_ROWS", "20"))
+tool_result_policy = os.getenv("TOOL_RESULT_POLICY", "head_tail")
@@ -0,0 +1,98 @@
+# context.py
+from pydantic import BaseModel
+from typing import List
+from llm_gateway import estimate_tokens
+from perception import PerceptionInput, build_prompt
+from config import context_token_budget, context_recent_turns, context_summary_chars
+
+
+class Turn(BaseModel):
+    iteration: int
+    perception: str
+    decision: str
+    action: str
+    synthesis: str = ""
+
+
+def truncate(text: str, max_chars: int) -> str:
+    text = " ".join(text.split())
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(" ", 1)[0] + " …"
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    # estimate_tokens() assumes ~4 characters per token, so invert it for the cut.
+    return text if estimate_tokens(text) <= max_tokens else truncate(text, max(0, max_tokens) * 4)
+
+
+class ConversationContext:
+    """
+    Structured history of one request's (perception, decision, action) turns.
+    The static system prompt is kept once and never folded into the query; the query
+    sent each iteration keeps the latest turns verbatim, older ones as one-line summaries,
+    and the whole prompt is held under `token_budget`.
+    """
+
+    def __init__(self, system_prompt: str, query: str, token_budget: int = context_token_budget,
+                 recent_turns: int = context_recent_turns, summary_chars: int = context_summary_chars,
+                 preamble: str = ""):
+        self.system_prompt = system_prompt
+        self.preamble = preamble
+        self.query = query
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.summary_chars = summary_chars
+        self.turns: List[Turn] = []
+        self.prompt_tokens: List[int] = []
+
+    def add_turn(self, turn: Turn):
+        self.turns.append(turn)
+
+    def _summary(self, turn: Turn) -> str:
+        outcome = turn.synthesis or turn.action
+        return f"Step {turn.iteration} ({turn.decision}): {truncate(outcome, self.summary_chars)}"
+
+    def _detail(self, turn: Turn, max_tokens: int) -> str:
+        outcome = turn.synthesis or turn.action
+        return f"Step {turn.iteration} ({turn.decision}):\n{truncate_to_tokens(outcome, max_tokens)}"
+
+    def available_tokens(self) -> int:
+        empty = PerceptionInput(system_prompt=self.system_prompt, preamble=self.preamble, user_query="")
+        return self.token_budget - estimate_tokens(build_prompt(empty))
+
+    def render(self) -> str:
+        """The user query for the next perception call."""
+        if not self.turns:
+            return self.query
+        available = self.available_tokens() - estimate_tokens(self.query) - 32
+        older = self.turns[:-self.recent_turns] if self.recent_turns else self.turns
+        recent = self.turns[len(older):]
+
+        summaries = [self._summary(turn) for turn in older]
+        # Drop the oldest summaries first if even they do not fit.
+        while summaries and sum(estimate_tokens(line) for line in summaries) > available // 2:
+            summaries.pop(0)
+        remaining = available - sum(estimate_tokens(line) for line in summaries)
+        per_turn = remaining // max(1, len(recent))
+        details = [self._detail(turn, per_turn) for turn in recent]
+
+        history = "\n".join(summaries + details)
+        return f"{self.query}\n\nProgress so far:\n{history}\nWhat should I do next?"
+
+    def fit(self, text: str, share: float = 0.5) -> str:
+        """Cap a single block (e.g. a tool result) to a share of the prompt budget."""
+        return truncate_to_tokens(text, int(self.available_tokens() * share))
+
+    def record_prompt(self, perception_input: PerceptionInput) -> int:
+        tokens = estimate_tokens(build_prompt(perception_input))
+        self.prompt_tokens.append(tokens)
+        return tokens
+
+    def metrics(self) -> dict:
+        return {
+            "token_budget": self.token_budget,
+            "prompt_tokens_per_call": self.prompt_tokens,
+            "max_prompt_tokens": max(self.prompt_tokens, default=0),
+            "turns": len(self.turns),
+        }
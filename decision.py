@@ -1,26 +1,227 @@
 # decision.py
+import re
+import ast
+import json
 from pydantic import BaseModel
-from typing import Any
+from typing import Any, List, Optional, Tuple
+from telemetry import metrics
+from tool_schema import get_schemas, validate_arguments
 
 class DecisionInput(BaseModel):
     model_response: str
 
+class ToolCall(BaseModel):
+    tool_name: str
+    arguments: dict = {}
+
 class DecisionOutput(BaseModel):
     action_type: str
     tool_name: str
     arguments: dict
+    # Every call requested in this step; tool_name/arguments mirror the first one
+    tool_calls: List[ToolCall] = []
+    # Set when action_type is "repair": what was wrong and the prompt asking the model to fix it
+    errors: List[str] = []
+    repair_prompt: Optional[str] = None
+
+ACTION_PREFIXES = {
+    "FUNCTION_CALL:": "function_call",
+    "FINAL_ANSWER:": "final_answer",
+    "COMPLETE_RUN": "complete_run",
+}
+
+def detect_action_type(partial_text: str) -> Optional[str]:
+    """
+    Classify a response from its first streamed characters. Returns None while the
+    prefix is still ambiguous, otherwise the action type ("unknown" if none matches).
+    """
+    text = partial_text.lstrip()
+    fenced = text.startswith("`")
+    text = text.lstrip("`")
+    if fenced and text[:4].lower() == "json":
+        text = text[4:]
+    elif fenced and "json".startswith(text.lower()):
+        return None
+    text = text.lstrip()
+    for prefix, action_type in ACTION_PREFIXES.items():
+        if text.startswith(prefix):
+            return action_type
+    if any(prefix.startswith(text) for prefix in ACTION_PREFIXES):
+        return None
+    return "unknown"
+
+class DecisionParseError(ValueError):
+    pass
+
+def _strip_comments(text: str) -> str:
+    """Drop //, # and /* */ comments and stray literal "\\n" sequences outside quoted strings."""
+    out = []
+    i, quote = 0, None
+    while i < len(text):
+        char = text[i]
+        if quote:
+            out.append(char)
+            if char == "\\" and i + 1 < len(text):
+                out.append(text[i + 1])
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+            out.append(char)
+        elif text.startswith("//", i) or char == "#":
+            while i < len(text) and text[i] != "\n":
+                i += 1
+            continue
+        elif text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            i = len(text) if end == -1 else end + 2
+            continue
+        elif text.startswith("\\n", i):
+            i += 2
+            continue
+        else:
+            out.append(char)
+        i += 1
+    return "".join(out)
+
+def extract_json(text: str) -> Any:
+    """
+    Parse the first JSON object or array in `text`, tolerating comments, trailing commas,
+    single quotes and whatever prose or further blocks follow it.
+    """
+    cleaned = _strip_comments(text)
+    start = min((i for i in (cleaned.find("{"), cleaned.find("[")) if i != -1), default=-1)
+    if start == -1:
+        raise DecisionParseError("no JSON object found after FUNCTION_CALL")
+    depth, quote, escaped = 0, None, False
+    for i in range(start, len(cleaned)):
+        char = cleaned[i]
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                block = re.sub(r",\s*([}\]])", r"\1", cleaned[start:i + 1])
+                try:
+                    return json.loads(block)
+                except json.JSONDecodeError as e:
+                    try:
+                        # Python-style literals: single quotes, True/False/None
+                        return ast.literal_eval(block)
+                    except (ValueError, SyntaxError):
+                        raise DecisionParseError(f"invalid JSON: {e}") from None
+    raise DecisionParseError("unbalanced JSON: the FUNCTION_CALL block is cut off")
+
+def _find_action(text: str) -> Tuple[Optional[str], str]:
+    """Return the earliest action prefix in `text` and everything after it."""
+    found = [(text.find(prefix), prefix) for prefix in ACTION_PREFIXES if prefix in text]
+    if not found:
+        return None, text
+    index, prefix = min(found)
+    return prefix, text[index + len(prefix):]
+
+def repair_prompt(response: str, errors: List[str]) -> str:
+    schemas = get_schemas()
+    named = {error.split(":", 1)[0] for error in errors}
+    signatures = [schemas[name].signature() for name in sorted(named) if name in schemas]
+    lines = [
+        "Your previous response could not be executed:",
+        *[f"- {error}" for error in errors],
+    ]
+    if signatures:
+        lines += ["Valid signatures:", *[f"- {signature}" for signature in signatures]]
+    lines += [
+        f"Previous response: {response.strip()[:500]}",
+        "Reply again with a corrected FUNCTION_CALL (plain JSON, no comments) or a FINAL_ANSWER.",
+    ]
+    return "\n".join(lines)
+
+def _parse_calls(payload: str) -> List[ToolCall]:
+    data = extract_json(payload)
+    # One call object, a list of them, or {"calls": [...]} for independent tools run in parallel
+    if isinstance(data, dict) and "calls" in data:
+        data = data["calls"]
+    items = data if isinstance(data, list) else [data]
+    calls = []
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get("name"), str):
+            raise DecisionParseError('each call must be an object with a "name" string')
+        arguments = item.get("arguments") or {}
+        if not isinstance(arguments, dict):
+            raise DecisionParseError(f'{item["name"]}: "arguments" must be an object')
+        calls.append(ToolCall(tool_name=item["name"], arguments=arguments))
+    if not calls:
+        raise DecisionParseError("FUNCTION_CALL contained no calls")
+    return calls
 
 def make_decision(dec_input: DecisionInput) -> DecisionOutput:
-    text = dec_input.model_response.strip()
-    text = text.replace("```json", "").replace("```", "").replace("\\n", "").strip()
-    if text.startswith("FUNCTION_CALL:"):
-        import json
-        content = text.split("FUNCTION_CALL:", 1)[-1].strip()
-        data = json.loads(content)
-        return DecisionOutput(action_type="function_call", tool_name=data['name'], arguments=data['arguments'])
-    elif text.startswith("FINAL_ANSWER:"):
-        return DecisionOutput(action_type="final_answer", tool_name="", arguments={"answer": text.split(":",1)[-1].strip()})
-    elif text.startswith("COMPLETE_RUN"):
+    """
+    Never raises: malformed or invalid FUNCTION_CALLs come back as action_type "repair"
+    with a `repair_prompt` naming what to fix, and are counted in decision_parse_total.
+    """
+    text = re.sub(r"```(?:json)?", "", dec_input.model_response).strip()
+    prefix, payload = _find_action(text)
+    if prefix == "FUNCTION_CALL:":
+        try:
+            calls = _parse_calls(payload)
+        except DecisionParseError as e:
+            metrics.inc("decision_parse_total", result="parse_error")
+            return DecisionOutput(action_type="repair", tool_name="", arguments={}, errors=[str(e)],
+                                  repair_prompt=repair_prompt(text, [str(e)]))
+        errors = []
+        for call in calls:
+            call.arguments, call_errors = validate_arguments(call.tool_name, call.arguments)
+            errors += call_errors
+        if errors:
+            metrics.inc("decision_parse_total", result="invalid_arguments")
+            return DecisionOutput(action_type="repair", tool_name=calls[0].tool_name, arguments=calls[0].arguments,
+                                  tool_calls=calls, errors=errors, repair_prompt=repair_prompt(text, errors))
+        metrics.inc("decision_parse_total", result="ok")
+        return DecisionOutput(action_type="function_call", tool_name=calls[0].tool_name,
+                              arguments=calls[0].arguments, tool_calls=calls)
+    elif prefix == "FINAL_ANSWER:":
+        metrics.inc("decision_parse_total", result="ok")
+        return DecisionOutput(action_type="final_answer", tool_name="", arguments={"answer": payload.strip()})
+    elif prefix == "COMPLETE_RUN":
+        metrics.inc("decision_parse_total", result="ok")
         return DecisionOutput(action_type="complete_run", tool_name="", arguments={})
     else:
-        return DecisionOutput(action_type="unknown", tool_name="", arguments={})
\ No newline at end of file
+        metrics.inc("decision_parse_total", result="unknown")
+        return DecisionOutput(action_type="unknown", tool_name="", arguments={})
+
+
+# (model response, expected action_type, expected arguments of the first call)
+PARSER_CASES = [
+    ('FUNCTION_CALL: {"name": "reorder_threshold", "arguments": {"product": "gloves", "daily_usage": "50", '
+     '"lead_time_days": 7.0}}', "function_call", {"product": "gloves", "daily_usage": 50, "lead_time_days": 7}),
+    ('FUNCTION_CALL: {"name": "estimate_restock_time", "arguments": {"product": "gloves", "current_stock": 40, '
+     '"daily_usage": 12.5}}', "function_call", {"product": "gloves", "current_stock": 40, "daily_usage": 12.5}),
+    ('FUNCTION_CALL: {"name": "layout_optimization", "arguments": {"warehouse_size": 50000}}',
+     "function_call", {"warehouse_size": "50000"}),
+    ("FUNCTION_CALL: {'name': 'optimize_picking_route', 'arguments': {'zone': 'A',},} // zone A",
+     "function_call", {"zone": "A"}),
+    ('FUNCTION_CALL: {"name": "reorder_threshold", "arguments": {"product": "gloves"}}', "repair", None),
+    ('FUNCTION_CALL: {"name": "no_such_tool", "arguments": {}}', "repair", None),
+    ("FINAL_ANSWER: [42]", "final_answer", {"answer": "[42]"}),
+]
+
+
+if __name__ == "__main__":
+    failed = 0
+    for response, action_type, arguments in PARSER_CASES:
+        decision = make_decision(DecisionInput(model_response=response))
+        ok = decision.action_type == action_type and (arguments is None or decision.arguments == arguments)
+        failed += not ok
+        print(f"{'ok ' if ok else 'BAD'} {decision.action_type} {decision.arguments} {decision.errors} <- {response}")
+    if failed:
+        raise SystemExit(f"{failed} parser check(s) failed")
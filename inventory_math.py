@@ -0,0 +1,177 @@
+# inventory_math.py
+# Vectorized inventory arithmetic behind the numeric MCP tools. Every function accepts
+# scalars or array-likes, so the same code answers one agent question or a whole catalog.
+#
+#   python inventory_math.py catalog.csv --out thresholds.csv
+import csv
+import argparse
+import numpy as np
+
+
+def _as_array(name: str, values, allow_zero: bool = True) -> np.ndarray:
+    array = np.asarray(values, dtype=float)
+    if not np.all(np.isfinite(array)):
+        raise ValueError(f"{name} must be finite numbers")
+    if np.any(array < 0) or (not allow_zero and np.any(array == 0)):
+        raise ValueError(f"{name} must be {'non-negative' if allow_zero else 'positive'}")
+    return array
+
+
+def _number(value):
+    """Convert a numpy scalar to a JSON-friendly int/float (None for infinity)."""
+    value = float(value)
+    if not np.isfinite(value):
+        return None
+    return int(value) if value.is_integer() else round(value, 4)
+
+
+def _numbers(array: np.ndarray) -> list:
+    array = np.round(np.ravel(array).astype(float), 4)
+    values = array.tolist()
+    if not np.all(np.isfinite(array)):
+        values = [value if np.isfinite(value) else None for value in values]
+    return values
+
+
+INFINITE = "infinite"  # days of stock when nothing is consumed
+
+
+def _days(array: np.ndarray) -> list:
+    # JSON has no infinity, and a null would be dropped from the prompt; say it in words
+    return [INFINITE if value is None else value for value in _numbers(array)]
+
+
+def storage_utilization(total_capacity, used_capacity) -> np.ndarray:
+    """Used capacity as a percentage of total capacity."""
+    total = _as_array("total_capacity", total_capacity, allow_zero=False)
+    used = _as_array("used_capacity", used_capacity)
+    if np.any(used > total):
+        raise ValueError("used_capacity must not exceed total_capacity")
+    return used / total * 100.0
+
+
+def reorder_threshold(daily_usage, lead_time_days, safety_stock=0) -> np.ndarray:
+    """Reorder point: demand during the replenishment lead time plus safety stock."""
+    usage = _as_array("daily_usage", daily_usage)
+    lead_time = _as_array("lead_time_days", lead_time_days)
+    safety = _as_array("safety_stock", safety_stock)
+    return usage * lead_time + safety
+
+
+def days_of_stock(current_stock, daily_usage) -> np.ndarray:
+    """How many days current stock lasts; np.inf where nothing is consumed."""
+    stock = _as_array("current_stock", current_stock)
+    usage = _as_array("daily_usage", daily_usage)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(usage > 0, stock / np.where(usage > 0, usage, 1), np.inf)
+
+
+# === Structured results returned by the MCP tools ===
+
+def storage_utilization_result(total_capacity: float, used_capacity: float) -> dict:
+    utilization = storage_utilization(total_capacity, used_capacity)
+    return {
+        "total_capacity": _number(total_capacity),
+        "used_capacity": _number(used_capacity),
+        "free_capacity": _number(total_capacity - used_capacity),
+        "utilization_pct": _number(utilization),
+        "formula": "used_capacity / total_capacity * 100",
+    }
+
+
+def reorder_threshold_result(product: str, daily_usage: float, lead_time_days: float, safety_stock: float = 0) -> dict:
+    return {
+        "product": product,
+        "daily_usage": _number(daily_usage),
+        "lead_time_days": _number(lead_time_days),
+        "safety_stock": _number(safety_stock),
+        "reorder_threshold": _number(reorder_threshold(daily_usage, lead_time_days, safety_stock)),
+        "formula": "daily_usage * lead_time_days + safety_stock",
+    }
+
+
+def restock_time_result(product: str, current_stock: float, daily_usage: float) -> dict:
+    return {
+        "product": product,
+        "current_stock": _number(current_stock),
+        "daily_usage": _number(daily_usage),
+        "days_of_stock": _days(days_of_stock(current_stock, daily_usage))[0],
+        "formula": "current_stock / daily_usage",
+    }
+
+
+def reorder_batch_result(products, daily_usage, lead_time_days, safety_stock=None, current_stock=None) -> dict:
+    """Column-oriented results for a whole catalog; inputs must all have the same length."""
+    count = len(products)
+    columns = {"daily_usage": daily_usage, "lead_time_days": lead_time_days}
+    if safety_stock is not None:
+        columns["safety_stock"] = safety_stock
+    if current_stock is not None:
+        columns["current_stock"] = current_stock
+    for name, values in columns.items():
+        if len(values) != count:
+            raise ValueError(f"{name} has {len(values)} values but there are {count} products")
+
+    thresholds = reorder_threshold(daily_usage, lead_time_days, 0 if safety_stock is None else safety_stock)
+    result = {"products": list(products), "reorder_threshold": _numbers(thresholds)}
+    if current_stock is not None:
+        stock = _as_array("current_stock", current_stock)
+        result["days_of_stock"] = _days(days_of_stock(stock, daily_usage))
+        result["needs_reorder"] = (stock <= thresholds).tolist()
+    return result
+
+
+CATALOG_COLUMNS = ("product", "daily_usage", "lead_time_days")
+
+
+def _read_catalog(path: str) -> dict:
+    with open(path, newline="", encoding="utf-8") as handle:
+        reader = csv.DictReader(handle)
+        rows = list(reader)
+        fields = reader.fieldnames or []
+    missing = [name for name in CATALOG_COLUMNS if name not in fields]
+    if missing:
+        raise ValueError(f"{path} is missing the column(s) {', '.join(missing)}")
+    columns = {"products": [row["product"] for row in rows]}
+    for name in ("daily_usage", "lead_time_days", "safety_stock", "current_stock"):
+        if name in fields:
+            columns[name] = np.array([_cell(path, number, row, name) for number, row in enumerate(rows, start=2)])
+    return columns
+
+
+def _cell(path: str, number: int, row: dict, name: str) -> float:
+    """A numeric catalog cell; blanks default to 0 only in the optional columns."""
+    value = (row[name] or "").strip()
+    if not value and name not in CATALOG_COLUMNS:
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{path} line {number}: {name} must be a number, got {value!r}") from None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute reorder thresholds for a whole catalog.")
+    parser.add_argument("catalog", help="CSV with product, daily_usage, lead_time_days[, safety_stock, current_stock]")
+    parser.add_argument("--out", default="reorder_thresholds.csv")
+    args = parser.parse_args()
+
+    try:
+        catalog = _read_catalog(args.catalog)
+    except ValueError as e:
+        parser.error(str(e))
+    result = reorder_batch_result(
+        catalog["products"], catalog["daily_usage"], catalog["lead_time_days"],
+        safety_stock=catalog.get("safety_stock"), current_stock=catalog.get("current_stock"),
+    )
+    fields = [name for name in ("reorder_threshold", "days_of_stock", "needs_reorder") if name in result]
+    with open(args.out, "w", newline="", encoding="utf-8") as handle:
+        writer = csv.writer(handle)
+        writer.writerow(["product"] + fields)
+        for index, product in enumerate(result["products"]):
+            writer.writerow([product] + [result[name][index] for name in fields])
+    print(f"Wrote {len(result['products'])} rows to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
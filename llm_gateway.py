@@ -0,0 +1,486 @@
+# llm_gateway.py
+import os
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Optional
+from pydantic import BaseModel
+from telemetry import metrics, span, record_span
+from config import (llm, llm_backend, llm_max_concurrency, llm_requests_per_minute, llm_tokens_per_minute,
+                    llm_max_retries, llm_context_cache, llm_context_cache_min_tokens, llm_context_cache_ttl,
+                    llm_context_cache_max_entries, llm_recording_path, llm_rate_limit_path)
+
+log = logging.getLogger(__name__)
+
+
+class LLMResponse(BaseModel):
+    text: str
+    prompt_tokens: int
+    response_tokens: int
+
+
+class LLMUsage(BaseModel):
+    calls: int = 0
+    prompt_tokens: int = 0
+    response_tokens: int = 0
+
+
+# Usage of the current task (e.g. one agent run); see track_usage()
+_usage: ContextVar[Optional[LLMUsage]] = ContextVar("llm_usage", default=None)
+
+
+def track_usage() -> LLMUsage:
+    """Start counting LLM calls made from the current task and the tasks it spawns."""
+    usage = LLMUsage()
+    _usage.set(usage)
+    return usage
+
+
+def _record_usage(prompt_tokens: int, response_tokens: int):
+    usage = _usage.get()
+    if usage is not None:
+        usage.calls += 1
+        usage.prompt_tokens += int(prompt_tokens)
+        usage.response_tokens += int(response_tokens)
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly 4 characters per token for English prose; good enough for budgeting.
+    return max(1, len(text) // 4)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return getattr(error, "code", None) == 429 or "RESOURCE_EXHAUSTED" in str(error)
+
+
+class TokenBucket:
+    """Refills `per_minute` units every minute; a per_minute of 0 disables the limit."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        if self.capacity <= 0:
+            return
+        amount = min(amount, self.capacity)
+        # Holding the lock while sleeping keeps waiters in FIFO order.
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def debit(self, amount: float):
+        """Charge usage that was only known after the call; may leave the bucket in debt."""
+        if self.capacity <= 0 or amount <= 0:
+            return
+        self._refill()
+        self.tokens -= amount
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    A TokenBucket whose level lives in a SQLite row, so every process opening `path` draws on
+    one budget instead of each getting the full `per_minute`. Database work runs in a thread.
+    """
+
+    def __init__(self, per_minute: float, path: str, name: str):
+        super().__init__(per_minute)
+        self.path = path
+        self.name = name
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, "
+                               "updated REAL NOT NULL)")
+        return self._conn
+
+    def _take(self, amount: float, force: bool = False) -> float:
+        """Take `amount` (always, with `force`); returns 0 or the seconds until it would be available."""
+        with self._db_lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (self.name,)).fetchone()
+                now = time.time()
+                tokens = self.capacity if row is None else min(self.capacity, row[0] + (now - row[1]) * self.rate)
+                wait = 0.0
+                if tokens >= amount or force:
+                    tokens -= amount
+                else:
+                    wait = (amount - tokens) / self.rate
+                conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                             (self.name, tokens, now))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    async def acquire(self, amount: float = 1):
+        if self.capacity <= 0:
+            return
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                wait = await asyncio.to_thread(self._take, amount)
+                if not wait:
+                    return
+                await asyncio.sleep(wait)
+
+    def debit(self, amount: float):
+        if self.capacity <= 0 or amount <= 0:
+            return
+        # Callers do not wait for the bookkeeping write, but a failed one must not vanish silently
+        future = asyncio.get_running_loop().run_in_executor(None, self._take, amount, True)
+        future.add_done_callback(self._debit_done)
+
+    def _debit_done(self, future: asyncio.Future):
+        if not future.cancelled() and future.exception() is not None:
+            log.warning("Lost a %s debit on the shared rate limit %s: %s", self.name, self.path, future.exception())
+
+
+def make_bucket(per_minute: float, name: str) -> TokenBucket:
+    if per_minute > 0 and llm_rate_limit_path:
+        return SharedTokenBucket(per_minute, llm_rate_limit_path, name)
+    return TokenBucket(per_minute)
+
+
+class LLMBackend:
+    name = "base"
+
+    async def generate(self, prompt: str, model: str, system: Optional[str] = None) -> LLMResponse:
+        raise NotImplementedError
+
+    async def stream(self, prompt: str, model: str, system: Optional[str] = None) -> AsyncIterator[str]:
+        # Backends without a streaming API deliver the whole response as one chunk.
+        response = await self.generate(prompt, model, system)
+        yield response.text
+
+
+class GeminiBackend(LLMBackend):
+    """Uses one genai.Client (per API key) and its native async API, so HTTP connections are reused."""
+    name = "gemini"
+
+    def __init__(self):
+        self._clients = {}
+        # LRU of system prompt -> (cache name, refresh time); evicted caches just expire provider-side
+        self._context_caches: OrderedDict = OrderedDict()
+
+    def client(self):
+        from google import genai
+        api_key = os.getenv("GEMINI_API_KEY")
+        if api_key not in self._clients:
+            self._clients[api_key] = genai.Client(api_key=api_key)
+        return self._clients[api_key]
+
+    async def _cached_system(self, client, model: str, system: str) -> Optional[str]:
+        # Provider-side context caching has a minimum size, so small prompts skip the attempt.
+        if not llm_context_cache or estimate_tokens(system) < llm_context_cache_min_tokens:
+            return None
+        from google.genai import types
+        key = (id(client), model, hashlib.sha256(system.encode()).hexdigest())
+        name, expires_at = self._context_caches.get(key, (None, 0.0))
+        if expires_at > time.time():
+            self._context_caches.move_to_end(key)
+            return name
+        try:
+            cached = await client.aio.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(system_instruction=system, ttl=f"{int(llm_context_cache_ttl)}s"),
+            )
+            name = cached.name
+        except Exception as e:
+            log.warning("Context caching unavailable, sending system prompt inline: %s", e)
+            name = None
+        # Refresh a little before the provider expires it; failures are not retried until then either.
+        self._context_caches[key] = (name, time.time() + llm_context_cache_ttl * 0.9)
+        self._context_caches.move_to_end(key)
+        while len(self._context_caches) > llm_context_cache_max_entries:
+            self._context_caches.popitem(last=False)
+        return name
+
+    async def _config(self, client, model: str, system: Optional[str]):
+        from google.genai import types
+        if not system:
+            return None
+        cached = await self._cached_system(client, model, system)
+        if cached:
+            return types.GenerateContentConfig(cached_content=cached)
+        return types.GenerateContentConfig(system_instruction=system)
+
+    async def generate(self, prompt: str, model: str, system: Optional[str] = None) -> LLMResponse:
+        client = self.client()
+        config = await self._config(client, model, system)
+        response = await client.aio.models.generate_content(model=model, contents=prompt, config=config)
+        usage = getattr(response, "usage_metadata", None)
+        text = response.text or ""
+        return LLMResponse(
+            text=text,
+            prompt_tokens=getattr(usage, "prompt_token_count", None) or estimate_tokens(prompt),
+            response_tokens=getattr(usage, "candidates_token_count", None) or estimate_tokens(text),
+        )
+
+    async def stream(self, prompt: str, model: str, system: Optional[str] = None) -> AsyncIterator[str]:
+        client = self.client()
+        config = await self._config(client, model, system)
+        async for chunk in await client.aio.models.generate_content_stream(model=model, contents=prompt, config=config):
+            if chunk.text:
+                yield chunk.text
+
+
+def _fake_arguments(prompt: str, tool: str) -> dict:
+    """Placeholder values for the required parameters of `tool`, read off its signature in the prompt."""
+    match = re.search(rf"^\s*- {tool}\((.*?)\)(?::|$)", prompt, flags=re.MULTILINE)
+    arguments = {}
+    for param in re.split(r",\s*(?![^\[]*\])", match.group(1)) if match and match.group(1) else []:
+        name, _, annotation = param.partition(":")
+        if "=" in annotation:
+            continue  # optional
+        value = "general" if "str" in annotation else 100
+        arguments[name.strip()] = [value] if "List" in annotation else value
+    return arguments
+
+
+def default_fake_responder(prompt: str) -> str:
+    # Mimics the shapes the agent loop expects so it can run end to end without a network.
+    if "Here is the action that was taken" in prompt:
+        return "Here is the final answer based on the tool output: " + prompt[-200:].strip()
+    if "Reply again with a corrected FUNCTION_CALL" in prompt:
+        signature = re.search(r"^Valid signatures:\n- (\w+)", prompt, flags=re.MULTILINE)
+        if signature is None:
+            return "FINAL_ANSWER: Fake model response: " + prompt[:200]
+        tool = signature.group(1)
+        return "FUNCTION_CALL: " + json.dumps({"name": tool, "arguments": _fake_arguments(prompt, tool)})
+    if "Respond using ONLY one of these formats" in prompt:
+        query = prompt.rsplit("Logistics Query:", 1)[-1].lower()
+        if "[mcp response]" in query:
+            # A tool already answered in an earlier turn (single-pass mode folds it in here)
+            return "FINAL_ANSWER: " + query.rsplit("[mcp response]", 1)[-1][:200].strip()
+        tools = re.findall(r"^\s*- (\w+)", prompt, flags=re.MULTILINE)
+        words = set(re.findall(r"[a-z]+", query))
+        best = max(tools, key=lambda name: len(words & set(name.split("_"))), default="suggest_kpis")
+        return "FUNCTION_CALL: " + json.dumps({"name": best, "arguments": _fake_arguments(prompt, best)})
+    return "Fake model response: " + prompt[:200]
+
+
+class FakeBackend(LLMBackend):
+    """Local stand-in model for tests and offline runs; select it with LLM_BACKEND=fake."""
+    name = "fake"
+
+    def __init__(self, responder: Optional[Callable[[str], str]] = None, latency: float = None):
+        self.responder = responder or default_fake_responder
+        self.latency = float(os.getenv("FAKE_LLM_LATENCY", "0")) if latency is None else latency
+
+    async def generate(self, prompt: str, model: str, system: Optional[str] = None) -> LLMResponse:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if system:
+            prompt = f"{system}\n\n{prompt}"
+        text = self.responder(prompt)
+        return LLMResponse(text=text, prompt_tokens=estimate_tokens(prompt), response_tokens=estimate_tokens(text))
+
+    async def stream(self, prompt: str, model: str, system: Optional[str] = None) -> AsyncIterator[str]:
+        response = await self.generate(prompt, model, system)
+        words = response.text.split(" ")
+        for index, word in enumerate(words):
+            yield word if index == len(words) - 1 else word + " "
+            await asyncio.sleep(0)
+
+
+class RecordingBackend(LLMBackend):
+    """Passes calls to `inner` and stores every response so ReplayBackend can serve it offline."""
+    name = "record"
+
+    def __init__(self, inner: Optional[LLMBackend] = None, path: str = llm_recording_path):
+        from cache import SQLiteStore
+        self.inner = inner or GeminiBackend()
+        self.store = SQLiteStore(path)
+
+    async def generate(self, prompt: str, model: str, system: Optional[str] = None) -> LLMResponse:
+        response = await self.inner.generate(prompt, model, system)
+        self.store.set(recording_key(prompt, model, system), response.model_dump(), expires_at=float("inf"))
+        return response
+
+
+class ReplayBackend(LLMBackend):
+    """Serves responses captured by RecordingBackend; unrecorded prompts are an error, never a network call."""
+    name = "replay"
+
+    def __init__(self, path: str = llm_recording_path):
+        from cache import SQLiteStore
+        self.store = SQLiteStore(path)
+
+    async def generate(self, prompt: str, model: str, system: Optional[str] = None) -> LLMResponse:
+        stored = self.store.get(recording_key(prompt, model, system))
+        if stored is None:
+            raise KeyError(f"No recorded response for prompt: {prompt[:80]!r}")
+        return LLMResponse(**stored[0])
+
+
+def recording_key(prompt: str, model: str, system: Optional[str]) -> str:
+    from cache import make_key
+    return make_key("recording", "llm", {"system": system or "", "prompt": prompt}, model)
+
+
+BACKENDS = {
+    "gemini": GeminiBackend,
+    "fake": FakeBackend,
+    "record": RecordingBackend,
+    "replay": ReplayBackend,
+}
+
+
+class LLMGateway:
+    """
+    Single entry point for every model call in the process: bounded concurrency,
+    request/token-per-minute buckets and backoff on 429s in front of a pluggable backend.
+    """
+
+    def __init__(self, backend: LLMBackend, max_concurrency: int = llm_max_concurrency,
+                 requests_per_minute: float = llm_requests_per_minute,
+                 tokens_per_minute: float = llm_tokens_per_minute, max_retries: int = llm_max_retries):
+        self.backend = backend
+        self.max_retries = max_retries
+        self.loop = asyncio.get_running_loop()
+        self.requests = make_bucket(requests_per_minute, "requests")
+        self.tokens = make_bucket(tokens_per_minute, "tokens")
+        self.calls = 0
+        self.rate_limited = 0
+        self.last_rate_limited: Optional[float] = None  # time.monotonic() of the last 429
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0  # calls holding a concurrency slot
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    @asynccontextmanager
+    async def _slot(self):
+        async with self._slots:
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    async def generate(self, prompt: str, model: str = llm, system: Optional[str] = None) -> LLMResponse:
+        """`system` is sent as a system instruction (cached provider-side when large enough)."""
+        estimated = estimate_tokens(prompt) + (estimate_tokens(system) if system else 0)
+        with span("llm", backend=self.backend.name, model=model, mode="generate") as record:
+            await self.tokens.acquire(estimated)
+            for attempt in range(self.max_retries + 1):
+                async with self._slot():
+                    await self.requests.acquire(1)
+                    try:
+                        response = await self.backend.generate(prompt, model, system)
+                        break
+                    except Exception as e:
+                        if not is_rate_limit_error(e):
+                            raise
+                        if attempt == self.max_retries:
+                            self.last_rate_limited = time.monotonic()
+                            raise
+                # Back off without holding a slot, so calls that are not rate limited keep flowing
+                await self._backoff(attempt)
+            record.update(prompt_tokens=response.prompt_tokens, response_tokens=response.response_tokens)
+        self.calls += 1
+        self.tokens.debit(response.prompt_tokens - estimated + response.response_tokens)
+        self._record(response.prompt_tokens, response.response_tokens)
+        return response
+
+    async def stream(self, prompt: str, model: str = llm, system: Optional[str] = None) -> AsyncIterator[str]:
+        """Like generate() but yields text chunks as they arrive; 429s are only retried before the first chunk."""
+        estimated = estimate_tokens(prompt) + (estimate_tokens(system) if system else 0)
+        started_at = time.perf_counter()
+        first_chunk_s = None
+        await self.tokens.acquire(estimated)
+        response_tokens = 0
+        for attempt in range(self.max_retries + 1):
+            async with self._slot():
+                await self.requests.acquire(1)
+                started = False
+                try:
+                    async for chunk in self.backend.stream(prompt, model, system):
+                        if not started:
+                            first_chunk_s = round(time.perf_counter() - started_at, 6)
+                        started = True
+                        response_tokens += len(chunk) / 4
+                        yield chunk
+                    break
+                except Exception as e:
+                    if started or not is_rate_limit_error(e):
+                        raise
+                    if attempt == self.max_retries:
+                        self.last_rate_limited = time.monotonic()
+                        raise
+            await self._backoff(attempt)
+        self.calls += 1
+        self.tokens.debit(response_tokens)
+        self._record(estimated, response_tokens)
+        record_span("llm", started_at, backend=self.backend.name, model=model, mode="stream",
+                    prompt_tokens=estimated, response_tokens=int(response_tokens), first_chunk_s=first_chunk_s)
+
+    def _record(self, prompt_tokens: int, response_tokens: float):
+        _record_usage(prompt_tokens, response_tokens)
+        metrics.inc("llm_calls_total", backend=self.backend.name)
+        metrics.inc("llm_tokens_total", prompt_tokens, backend=self.backend.name, kind="prompt")
+        metrics.inc("llm_tokens_total", int(response_tokens), backend=self.backend.name, kind="response")
+
+    async def _backoff(self, attempt: int):
+        self.rate_limited += 1
+        self.last_rate_limited = time.monotonic()
+        delay = 2 ** attempt
+        metrics.inc("llm_rate_limited_total", backend=self.backend.name)
+        # Logging goes to stderr; inside mcp_server.py stdout carries the MCP stdio transport
+        log.warning("Rate limited, retrying in %ss", delay)
+        await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {"backend": self.backend.name, "calls": self.calls, "rate_limited": self.rate_limited,
+                "in_flight": self.in_flight, "max_concurrency": self.max_concurrency}
+
+
+_gateway: Optional[LLMGateway] = None
+_backend: Optional[LLMBackend] = None
+_gateway_options: dict = {}
+
+
+def get_gateway() -> LLMGateway:
+    """Return the process-wide gateway for the running event loop."""
+    global _gateway
+    loop = asyncio.get_running_loop()
+    if _gateway is None or _gateway.loop is not loop:
+        _gateway = LLMGateway(_backend or BACKENDS[llm_backend](), **_gateway_options)
+    return _gateway
+
+
+def set_backend(backend: Optional[LLMBackend], **gateway_options):
+    """
+    Swap the model backend, e.g. for a FakeBackend in tests; None restores the configured one.
+    Keyword options override LLMGateway defaults such as requests_per_minute.
+    """
+    global _gateway, _backend, _gateway_options
+    _backend = backend
+    _gateway_options = gateway_options
+    _gateway = None
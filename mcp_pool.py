@@ -0,0 +1,288 @@
+# mcp_pool.py
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Optional, Union
+from mcp.client.stdio import stdio_client
+from mcp.client.streamable_http import streamablehttp_client
+from mcp import ClientSession, StdioServerParameters
+from telemetry import metrics, span
+from config import mcp_pool_size, mcp_max_in_flight, mcp_call_timeout, mcp_health_interval, mcp_server_url
+
+
+log = logging.getLogger(__name__)
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mcp_server.py")
+
+
+# A stdio server to spawn, or the URL of a streamable HTTP server
+ServerParams = Union[StdioServerParameters, str]
+
+
+def default_server_params() -> ServerParams:
+    if mcp_server_url:
+        return mcp_server_url
+    return StdioServerParameters(
+        command="python",
+        args=[SERVER_SCRIPT],
+        # The full environment carries GEMINI_API_KEY (kept off the command line), LLM_BACKEND and
+        # the other config overrides to the servers
+        env=dict(os.environ),
+    )
+
+
+class PooledServer:
+    """
+    One long-lived MCP server process plus the ClientSession talking to it; for an HTTP
+    server, one ClientSession whose HTTP client keeps its connections alive between calls.
+    """
+
+    def __init__(self, index: int, server_params: ServerParams):
+        self.index = index
+        self.server_params = server_params
+        self.session: Optional[ClientSession] = None
+        self.restarts = 0
+        self.last_error: Optional[BaseException] = None
+        self.stale = False  # a call was abandoned mid-flight; restart before the next use
+        self._ready = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and self._task is not None and not self._task.done()
+
+    async def start(self):
+        self.stale = False
+        self._ready.clear()
+        self._stop.clear()
+        # The stdio/session context managers must be entered and exited in the
+        # same task, so each server lives inside its own long-running task.
+        with span("mcp_spawn", server=self.index, transport=self.transport):
+            self._task = asyncio.create_task(self._run(), name=f"mcp-server-{self.index}")
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=30)
+            except asyncio.TimeoutError:
+                self._stop.set()
+                self._task.cancel()
+                raise RuntimeError(f"MCP server {self.index} did not finish initialize in time")
+            if self.session is None:
+                raise RuntimeError(f"MCP server {self.index} failed to start: {self.last_error}")
+
+    @property
+    def transport(self) -> str:
+        return "http" if isinstance(self.server_params, str) else "stdio"
+
+    def _connect(self):
+        if isinstance(self.server_params, str):
+            return streamablehttp_client(self.server_params)
+        return stdio_client(self.server_params)
+
+    async def _run(self):
+        try:
+            async with self._connect() as streams:
+                read, write = streams[0], streams[1]  # streamable HTTP also yields a session id getter
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    self.session = session
+                    self._ready.set()
+                    await self._stop.wait()
+        except Exception as e:
+            self.last_error = e
+        finally:
+            self.session = None
+            self._ready.set()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout=5)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                self._task.cancel()
+            self._task = None
+
+    async def restart(self):
+        await self.stop()
+        self.restarts += 1
+        metrics.inc("mcp_restarts_total")
+        await self.start()
+
+
+class MCPToolPool:
+    """
+    Keeps `size` MCP server processes running and hands them out one call at a time.
+    At most `max_in_flight` tool calls are admitted concurrently; the rest wait.
+    """
+
+    def __init__(self, server_params: Optional[ServerParams] = None, size: int = mcp_pool_size,
+                 max_in_flight: int = mcp_max_in_flight, call_timeout: float = mcp_call_timeout,
+                 health_interval: float = mcp_health_interval):
+        self.server_params = server_params or default_server_params()
+        self.size = size
+        self.call_timeout = call_timeout
+        self.health_interval = health_interval
+        self.loop = asyncio.get_running_loop()
+        self.servers = [PooledServer(i, self.server_params) for i in range(size)]
+        self.calls = 0
+        self.errors = 0
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._in_flight = asyncio.Semaphore(max_in_flight)
+        self._start_lock = asyncio.Lock()
+        self._started = False
+        self._health_task: Optional[asyncio.Task] = None
+        self._recovering: set = set()  # background restarts of servers whose call failed
+
+    async def start(self):
+        async with self._start_lock:
+            if self._started:
+                return
+            results = await asyncio.gather(*(server.start() for server in self.servers), return_exceptions=True)
+            errors = [result for result in results if isinstance(result, BaseException)]
+            if errors:
+                # Don't leave the servers that did come up running outside the pool; the next start() retries all
+                await asyncio.gather(*(server.stop() for server in self.servers))
+                raise errors[0]
+            for server in self.servers:
+                self._idle.put_nowait(server)
+            if self.health_interval > 0:
+                self._health_task = asyncio.create_task(self._health_loop(), name="mcp-pool-health")
+            self._started = True
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for task in list(self._recovering):
+            task.cancel()
+        await asyncio.gather(*(server.stop() for server in self.servers), return_exceptions=True)
+        self._started = False
+
+    async def _checkout(self) -> PooledServer:
+        server = await self._idle.get()
+        if not server.alive or server.stale:
+            log.warning("Server %d is down (%s), restarting", server.index, server.last_error)
+            try:
+                await server.restart()
+            except BaseException:
+                # Also reached when the caller's deadline expires mid-restart; the next checkout retries
+                server.stale = True
+                self._idle.put_nowait(server)
+                raise
+        return server
+
+    def _recover(self, server: PooledServer):
+        """Restart `server` in the background, then hand it back to the idle queue."""
+        async def recover():
+            try:
+                await server.restart()
+            except Exception as restart_error:
+                log.error("Restart of server %d failed: %s", server.index, restart_error)
+            finally:
+                self._idle.put_nowait(server)
+
+        task = asyncio.create_task(recover(), name=f"mcp-recover-{server.index}")
+        self._recovering.add(task)
+        task.add_done_callback(self._recovering.discard)
+
+    async def _call(self, operation):
+        waited = time.perf_counter()
+        async with self._in_flight:
+            server = await self._checkout()
+            metrics.observe("mcp_checkout_wait_seconds", time.perf_counter() - waited)
+            try:
+                result = await operation(server.session)
+            except BaseException as e:
+                # Transport failures, timeouts and cancellations leave the session in an unknown
+                # state; the caller gets its error now and the restart happens behind its back.
+                server.last_error = e
+                self._recover(server)
+                raise
+            self._idle.put_nowait(server)
+            return result
+
+    async def _run(self, operation, timeout: Optional[float] = None):
+        await self.start()
+        try:
+            # One deadline for waiting on admission, checking out (and maybe restarting) a server and the call
+            return await asyncio.wait_for(self._call(operation), timeout=timeout or self.call_timeout)
+        except BaseException as e:
+            self.errors += 1
+            metrics.inc("mcp_errors_total", error=type(e).__name__)
+            raise
+
+    async def call_tool(self, tool_name: str, arguments: dict, timeout: Optional[float] = None) -> Any:
+        """`timeout` overrides the pool's call_timeout; a timed-out server is restarted."""
+        self.calls += 1
+        return await self._run(lambda session: session.call_tool(tool_name, arguments), timeout)
+
+    async def list_tools(self) -> Any:
+        return await self._run(lambda session: session.list_tools())
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            # Only idle servers are pinged so health checks never queue behind tool calls.
+            for _ in range(self._idle.qsize()):
+                try:
+                    server = self._idle.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                try:
+                    if not server.alive:
+                        raise RuntimeError("process exited")
+                    await asyncio.wait_for(server.session.send_ping(), timeout=5)
+                except Exception as e:
+                    log.warning("Health check failed for server %d: %s", server.index, e)
+                    server.last_error = e
+                    try:
+                        await server.restart()
+                    except Exception as restart_error:
+                        log.error("Restart of server %d failed: %s", server.index, restart_error)
+                finally:
+                    self._idle.put_nowait(server)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize(),
+            "calls": self.calls,
+            "errors": self.errors,
+            "restarts": sum(server.restarts for server in self.servers),
+        }
+
+
+_pool: Optional[MCPToolPool] = None
+
+
+def get_pool() -> MCPToolPool:
+    """Return the process-wide pool, creating it on first use in the running event loop."""
+    global _pool
+    loop = asyncio.get_running_loop()
+    if _pool is None or _pool.loop is not loop:
+        if _pool is not None:
+            _discard(_pool)
+        _pool = MCPToolPool()
+    return _pool
+
+
+def _discard(pool: MCPToolPool):
+    """Close a pool left behind on another event loop; its servers can only be stopped from that loop."""
+    old = pool.loop
+    if old.is_closed():
+        # asyncio.run cancelled the server tasks while shutting the loop down, which stopped them
+        return
+    if old.is_running():
+        asyncio.run_coroutine_threadsafe(pool.close(), old)
+    else:
+        # This thread is busy running the new loop, so drive the idle old one from a helper thread
+        threading.Thread(target=old.run_until_complete, args=(pool.close(),), name="mcp-pool-close").start()
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
@@ -1,143 +1,241 @@
 # mcp_server.py
+# Warehouse tools over MCP. Credentials come from the environment (GEMINI_API_KEY).
+#
+#   python mcp_server.py                                              # stdio, spawned by mcp_pool.py
+#   python mcp_server.py --transport streamable-http --workers 4      # http://127.0.0.1:8000/mcp
 import os
-import asyncio
+import json
 import argparse
-from google import genai
-from config import llm
+import functools
+from typing import List, Optional
+from llm_gateway import get_gateway, track_usage
+from cache import cached_tool
+import inventory_math
 from mcp.server.fastmcp import FastMCP
 from mcp.types import TextContent
 
-# Set the key as an environment variable
-parser = argparse.ArgumentParser(description="Start the Logistics MCP server.")
-parser.add_argument("--env-key", type=str, required=True, help="Gemini environment key (API key)")
-args = parser.parse_args()
-os.environ["GEMINI_API_KEY"] = args.env_key
-
 async def call_llm(prompt: str) -> str:
     # Modify the prompt to include reasoning
-    client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
     reasoning_prompt = f"Please explain step-by-step how you arrived at the following conclusion: {prompt}"
-    response = await asyncio.get_event_loop().run_in_executor(
-        None,
-        lambda: client.models.generate_content(
-            model=llm,
-            contents=reasoning_prompt
-        )
-    )
+    response = await get_gateway().generate(reasoning_prompt)
     return response.text.strip()
 
+async def explain_calculation(result: dict) -> dict:
+    # The numbers come from inventory_math; the LLM is only asked to narrate them.
+    prompt = f"Explain this warehouse calculation and what the result means operationally: {json.dumps(result)}"
+    result["explanation"] = await call_llm(prompt)
+    return result
+
+def reports_llm_usage(fn):
+    """
+    Add {"llm_usage": {...}} to a tool's result when it called the LLM, so the agent can count
+    the calls made here. Goes above @cached_tool: a cache hit makes no call and reports none.
+    """
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        usage = track_usage()
+        result = await fn(*args, **kwargs)
+        if usage.calls and isinstance(result, dict):
+            result = {**result, "llm_usage": {"calls": usage.calls, "prompt_tokens": usage.prompt_tokens}}
+        return result
+
+    return wrapper
+
 mcp = FastMCP("Logistics MCP")
 
 # === Core Logistics Tools ===
 @mcp.tool()
+@reports_llm_usage
+@cached_tool
 async def suggest_kpis() -> dict:
+    """Suggest key performance indicators for warehouse and logistics operations."""
     prompt = "Suggest 5 key performance indicators (KPIs) for warehouse and logistics operations."
     result = await call_llm(prompt)
     return {"content": [TextContent(type="text", text=result)]}
 
 @mcp.tool()
-async def calculate_storage_utilization(total_capacity: int, used_capacity: int) -> dict:
-    prompt = f"Calculate the storage utilization percentage when total capacity is {total_capacity} and used capacity is {used_capacity}. Provide step-by-step reasoning."
-    result = await call_llm(prompt)
-    return {"content": [TextContent(type="text", text=result)]}
+@reports_llm_usage
+async def calculate_storage_utilization(total_capacity: float, used_capacity: float, explain: bool = False) -> dict:
+    """Storage utilization percentage from total and used capacity (units or pallet positions)."""
+    result = inventory_math.storage_utilization_result(total_capacity, used_capacity)
+    return await explain_calculation(result) if explain else result
 
 @mcp.tool()
+@reports_llm_usage
+@cached_tool
 async def optimize_picking_route(zone: str) -> dict:
+    """Picking route strategy for a warehouse zone to cut picker travel time."""
     prompt = f"Suggest an efficient picking route strategy for a warehouse zone labeled '{zone}'. Explain your reasoning."
     result = await call_llm(prompt)
     return {"content": [TextContent(type="text", text=result)]}
 
 # === Inventory Tools ===
 @mcp.tool()
-async def reorder_threshold(product: str, daily_usage: int, lead_time_days: int) -> dict:
-    prompt = f"Determine the reorder threshold for {product} given a daily usage of {daily_usage} units and lead time of {lead_time_days} days. Please provide a step-by-step calculation."
-    result = await call_llm(prompt)
-    return {"content": [TextContent(type="text", text=result)]}
+@reports_llm_usage
+async def reorder_threshold(product: str, daily_usage: float, lead_time_days: float, safety_stock: float = 0,
+                            explain: bool = False) -> dict:
+    """Reorder point for a product from daily usage, supplier lead time and optional safety stock."""
+    result = inventory_math.reorder_threshold_result(product, daily_usage, lead_time_days, safety_stock)
+    return await explain_calculation(result) if explain else result
 
 @mcp.tool()
-async def estimate_restock_time(product: str, current_stock: int, daily_usage: int) -> dict:
-    prompt = f"Estimate how many days current stock of {current_stock} units for {product} will last, assuming a daily usage of {daily_usage}. Include your reasoning."
-    result = await call_llm(prompt)
-    return {"content": [TextContent(type="text", text=result)]}
+@reports_llm_usage
+async def reorder_threshold_batch(products: List[str], daily_usage: List[float], lead_time_days: List[float],
+                                  safety_stock: Optional[List[float]] = None,
+                                  current_stock: Optional[List[float]] = None) -> dict:
+    """Reorder points for many products at once from parallel lists of usage and lead times."""
+    return inventory_math.reorder_batch_result(products, daily_usage, lead_time_days, safety_stock, current_stock)
 
 @mcp.tool()
+@reports_llm_usage
+async def estimate_restock_time(product: str, current_stock: float, daily_usage: float, explain: bool = False) -> dict:
+    """Days of stock left for a product before it must be restocked, from current stock and daily usage."""
+    result = inventory_math.restock_time_result(product, current_stock, daily_usage)
+    return await explain_calculation(result) if explain else result
+
+@mcp.tool()
+@reports_llm_usage
+@cached_tool
 async def suggest_inventory_kpis() -> dict:
+    """Suggest KPIs for inventory management such as turnover, accuracy and stockout rate."""
     prompt = "List key performance indicators (KPIs) specifically for inventory management. Please explain how each KPI is relevant."
     result = await call_llm(prompt)
     return {"content": [TextContent(type="text", text=result)]}
 
 # === Additional Tools to Reach 20 ===
 @mcp.tool()
+@reports_llm_usage
+@cached_tool
 async def suggest_slotting_strategy(product_type: str) -> dict:
+    """Slotting strategy (where to store items) for a product type, e.g. perishable or bulky goods."""
     prompt = f"Suggest a warehouse slotting strategy for {product_type} products. Provide reasoning for your recommendations."
     result = await call_llm(prompt)
     return {"content": [TextContent(type="text", text=result)]}
 
 @mcp.tool()
+@reports_llm_usage
+@cached_tool
 async def layout_optimization(warehouse_size: str) -> dict:
+    """Warehouse layout and workflow improvements for a given warehouse size."""
     prompt = f"Suggest layout optimization strategies for a {warehouse_size} warehouse. Please explain the rationale behind your suggestions."
     result = await call_llm(prompt)
     return {"content": [TextContent(type="text", text=result)]}
 
 @mcp.tool()
+@reports_llm_usage
+@cached_tool
 async def receiving_process_improvement() -> dict:
+    """Improvements for the receiving process and inbound logistics."""
     prompt = "Suggest improvements for warehouse receiving and inbound logistics. Explain the reasoning behind your suggestions."
     result = await call_llm(prompt)
     return {"content": [TextContent(type="text", text=result)]}
 
 @mcp.tool()
+@reports_llm_usage
+@cached_tool
 async def warehouse_safety_checklist() -> dict:
+    """Daily warehouse safety checklist covering hazards, equipment and protocols."""
     prompt = "Create a warehouse safety checklist for daily operations. Include reasoning for why each item is necessary."
     result = await call_llm(prompt)
     return {"content": [TextContent(type="text", text=result)]}
 
 @mcp.tool()
+@reports_llm_usage
+@cached_tool
 async def forecast_inventory(product: str, season: str) -> dict:
+    """Forecast inventory demand for a product during a season such as the holidays."""
     prompt = f"Forecast inventory demand for {product} during the {season} season. Please explain the methodology you used to make the forecast."
     result = await call_llm(prompt)
     return {"content": [TextContent(type="text", text=result)]}
 
 @mcp.tool()
+@reports_llm_usage
+@cached_tool
 async def return_processing_guide() -> dict:
+    """Best practices for processing and tracking returned goods."""
     prompt = "Provide best practices for processing returned goods in a warehouse. Explain why each practice is important."
     result = await call_llm(prompt)
     return {"content": [TextContent(type="text", text=result)]}
 
 @mcp.tool()
+@reports_llm_usage
+@cached_tool
 async def loading_dock_efficiency() -> dict:
+    """Ways to improve loading dock throughput and reduce truck waiting time."""
     prompt = "Suggest ways to improve loading dock efficiency in logistics. Provide reasoning behind your suggestions."
     result = await call_llm(prompt)
     return {"content": [TextContent(type="text", text=result)]}
 
 @mcp.tool()
+@reports_llm_usage
+@cached_tool
 async def cycle_count_strategy() -> dict:
+    """Cycle counting strategy to keep inventory records accurate."""
     prompt = "What is an effective cycle count strategy for inventory control? Please explain how it ensures accuracy."
     result = await call_llm(prompt)
     return {"content": [TextContent(type="text", text=result)]}
 
 @mcp.tool()
+@reports_llm_usage
+@cached_tool
 async def identify_bottlenecks() -> dict:
+    """Find and resolve bottlenecks in warehouse and supply chain operations."""
     prompt = "How can I identify and resolve bottlenecks in warehouse operations? Provide a step-by-step breakdown."
     result = await call_llm(prompt)
     return {"content": [TextContent(type="text", text=result)]}
 
 @mcp.tool()
+@reports_llm_usage
+@cached_tool
 async def fleet_optimization() -> dict:
+    """Fleet and delivery optimization: vehicles, last-mile routes and fuel costs."""
     prompt = "Suggest fleet optimization strategies for a logistics company. Include reasoning for each suggestion."
     result = await call_llm(prompt)
     return {"content": [TextContent(type="text", text=result)]}
 
 @mcp.tool()
+@reports_llm_usage
+@cached_tool
 async def packaging_material_advice(product: str) -> dict:
+    """Packaging material recommendation for shipping a product."""
     prompt = f"Suggest optimal packaging material for shipping {product}. Please explain the factors that influence your choice."
     result = await call_llm(prompt)
     return {"content": [TextContent(type="text", text=result)]}
 
 @mcp.tool()
+@reports_llm_usage
+@cached_tool
 async def employee_training_plan(role: str) -> dict:
+    """Training plan for a warehouse role such as forklift operator or warehouse manager."""
     prompt = f"Create a training plan for a new warehouse {role}. Provide reasoning behind the key components of the plan."
     result = await call_llm(prompt)
     return {"content": [TextContent(type="text", text=result)]}
 
+def http_app():
+    """
+    ASGI app for the streamable HTTP transport. Stateless with plain JSON responses, so any
+    worker process can serve any request and no session affinity is needed behind the socket.
+    """
+    mcp.settings.stateless_http = True
+    mcp.settings.json_response = True
+    return mcp.streamable_http_app()
+
 if __name__ == "__main__":
-    mcp.run(transport="stdio")
+    parser = argparse.ArgumentParser(description="Start the Logistics MCP server.")
+    parser.add_argument("--transport", choices=["stdio", "streamable-http"], default="stdio")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes (streamable-http only)")
+    parser.add_argument("--env-key", type=str, default=None,
+                        help="Gemini API key; deprecated, it shows up in ps output, set GEMINI_API_KEY instead")
+    args = parser.parse_args()
+    if args.env_key:
+        os.environ["GEMINI_API_KEY"] = args.env_key
+
+    if args.transport == "stdio":
+        mcp.run(transport="stdio")
+    else:
+        import uvicorn
+        # An import string is required for more than one worker; each worker builds its own app
+        uvicorn.run("mcp_server:http_app", factory=True, host=args.host, port=args.port, workers=args.workers,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)), log_level="warning")
@@ -1,19 +1,271 @@
 # memory.py
+import json
+import time
+import atexit
+import asyncio
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
 from pydantic import BaseModel
-from typing import Dict
+from typing import Dict, Optional, Tuple
+from config import (memory_backend, memory_sqlite_path, memory_redis_url, memory_max_sessions,
+                    memory_idle_ttl, memory_flush_batch, memory_flush_interval)
+
+log = logging.getLogger(__name__)
 
 class MemoryInput(BaseModel):
     key: str
     value: dict
+    session_id: str = "default"
 
 class MemoryOutput(BaseModel):
-    memory_store: Dict[str, dict]
+    session_id: str
+    key: str
+    stored: bool = True
+
+
+class MemoryBackend:
+    name = "base"
+
+    def load(self, session_id: str, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def save_many(self, items: Dict[Tuple[str, str], dict]):
+        raise NotImplementedError
+
+    def delete_session(self, session_id: str):
+        raise NotImplementedError
+
+    def expire(self, idle_before: float):
+        """Drop sessions last written before `idle_before` (persistent backends only)."""
+
+
+class InMemoryBackend(MemoryBackend):
+    """Per-session dicts with LRU eviction of whole sessions once `max_sessions` is reached."""
+    name = "memory"
+
+    def __init__(self, max_sessions: int = memory_max_sessions):
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict = OrderedDict()
+
+    def load(self, session_id: str, key: str) -> Optional[dict]:
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        self._sessions.move_to_end(session_id)
+        return session.get(key)
+
+    def save_many(self, items: Dict[Tuple[str, str], dict]):
+        for (session_id, key), value in items.items():
+            self._sessions.setdefault(session_id, {})[key] = value
+            self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def delete_session(self, session_id: str):
+        self._sessions.pop(session_id, None)
+
+
+class SQLiteBackend(MemoryBackend):
+    name = "sqlite"
+
+    def __init__(self, path: str = memory_sqlite_path):
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS memory (session_id TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "updated_at REAL NOT NULL, PRIMARY KEY (session_id, key))"
+        )
+        self._conn.commit()
+
+    def load(self, session_id: str, key: str) -> Optional[dict]:
+        row = self._conn.execute(
+            "SELECT value FROM memory WHERE session_id = ? AND key = ?", (session_id, key)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_many(self, items: Dict[Tuple[str, str], dict]):
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO memory (session_id, key, value, updated_at) VALUES (?, ?, ?, ?)",
+            [(session_id, key, json.dumps(value), now) for (session_id, key), value in items.items()],
+        )
+        self._conn.commit()
+
+    def delete_session(self, session_id: str):
+        self._conn.execute("DELETE FROM memory WHERE session_id = ?", (session_id,))
+        self._conn.commit()
+
+    def expire(self, idle_before: float):
+        self._conn.execute(
+            "DELETE FROM memory WHERE session_id IN "
+            "(SELECT session_id FROM memory GROUP BY session_id HAVING MAX(updated_at) < ?)",
+            (idle_before,),
+        )
+        self._conn.commit()
+
+
+class RedisBackend(MemoryBackend):
+    """One hash per session in any Redis-compatible server (Redis, Valkey, KeyDB, ...)."""
+    name = "redis"
+
+    def __init__(self, url: str = memory_redis_url, idle_ttl: float = memory_idle_ttl):
+        import redis
+        self.idle_ttl = int(idle_ttl)
+        self._client = redis.Redis.from_url(url)
+
+    def _key(self, session_id: str) -> str:
+        return f"memory:{session_id}"
+
+    def load(self, session_id: str, key: str) -> Optional[dict]:
+        value = self._client.hget(self._key(session_id), key)
+        return json.loads(value) if value is not None else None
+
+    def save_many(self, items: Dict[Tuple[str, str], dict]):
+        pipeline = self._client.pipeline()
+        for (session_id, key), value in items.items():
+            pipeline.hset(self._key(session_id), key, json.dumps(value))
+            # Redis expires idle sessions on its own
+            pipeline.expire(self._key(session_id), self.idle_ttl)
+        pipeline.execute()
+
+    def delete_session(self, session_id: str):
+        self._client.delete(self._key(session_id))
+
+
+BACKENDS = {
+    "memory": InMemoryBackend,
+    "sqlite": SQLiteBackend,
+    "redis": RedisBackend,
+}
+
+
+class MemoryStore:
+    """
+    Session-scoped key/value memory with write-behind batching: writes land in a small
+    buffer that a background task flushes to the backend every `flush_interval` seconds,
+    or as soon as `flush_batch` writes are waiting, and sessions idle for longer than
+    `idle_ttl` are expired. Backend I/O runs in a worker thread, never on the event loop.
+    """
+
+    def __init__(self, backend: MemoryBackend, flush_batch: int = memory_flush_batch,
+                 flush_interval: float = memory_flush_interval, idle_ttl: float = memory_idle_ttl):
+        self.backend = backend
+        self.flush_batch = flush_batch
+        self.flush_interval = flush_interval
+        self.idle_ttl = idle_ttl
+        self._pending: Dict[Tuple[str, str], dict] = {}
+        self._flushing: Dict[Tuple[str, str], dict] = {}  # handed to the backend, not yet written
+        self._last_access: Dict[str, float] = {}
+        self._last_expiry = time.time()
+        self._lock = threading.RLock()  # guards the buffers; never held across backend I/O
+        self._io_lock = threading.RLock()  # one backend call at a time (SQLite connections are not thread-safe)
+        self._flusher: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    def set(self, session_id: str, key: str, value: dict):
+        with self._lock:
+            self._pending[(session_id, key)] = value
+            self._last_access[session_id] = time.time()
+            full = len(self._pending) >= self.flush_batch
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()  # no event loop to flush from (scripts, shutdown): write through
+            return
+        if self._flusher is None or self._flusher.done() or self._flusher.get_loop() is not loop:
+            self._wake = asyncio.Event()
+            self._flusher = loop.create_task(self._flush_loop(), name="memory-flush")
+        if full:
+            self._wake.set()
+
+    async def _flush_loop(self):
+        # Runs while writes are buffered, so no write waits longer than flush_interval
+        while self._pending:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                log.error("Flushing memory to the %s backend failed, retrying: %s", self.backend.name, e)
+
+    def _buffered(self, session_id: str, key: str) -> Optional[dict]:
+        with self._lock:
+            self._last_access[session_id] = time.time()
+            for buffer in (self._pending, self._flushing):
+                if (session_id, key) in buffer:
+                    return buffer[(session_id, key)]
+        return None
+
+    def get(self, session_id: str, key: str) -> Optional[dict]:
+        value = self._buffered(session_id, key)
+        if value is not None:
+            return value
+        with self._io_lock:
+            return self.backend.load(session_id, key)
+
+    async def aget(self, session_id: str, key: str) -> Optional[dict]:
+        value = self._buffered(session_id, key)
+        if value is not None:
+            return value
+        return await asyncio.to_thread(self.get, session_id, key)
+
+    def flush(self):
+        """Write buffered values to the backend. Blocks; call it through asyncio.to_thread on the loop."""
+        with self._io_lock:
+            with self._lock:
+                self._flushing, self._pending = self._pending, {}
+            try:
+                if self._flushing:
+                    self.backend.save_many(self._flushing)
+            except Exception:
+                with self._lock:
+                    # Keep the values for the next attempt; anything written since is newer
+                    self._pending = {**self._flushing, **self._pending}
+                raise
+            finally:
+                with self._lock:
+                    self._flushing = {}
+            if time.time() - self._last_expiry >= min(self.idle_ttl, 60):
+                self.expire_idle()
+
+    def expire_idle(self):
+        with self._io_lock:
+            now = time.time()
+            cutoff = now - self.idle_ttl
+            with self._lock:
+                idle = [session_id for session_id, last_access in self._last_access.items() if last_access < cutoff]
+            for session_id in idle:
+                self.drop_session(session_id)
+            self.backend.expire(cutoff)
+            self._last_expiry = now
+
+    def drop_session(self, session_id: str):
+        with self._io_lock:
+            with self._lock:
+                self._pending = {k: v for k, v in self._pending.items() if k[0] != session_id}
+                self._last_access.pop(session_id, None)
+            self.backend.delete_session(session_id)
+
+
+_store: Optional[MemoryStore] = None
+
+
+def get_store() -> MemoryStore:
+    global _store
+    if _store is None:
+        _store = MemoryStore(BACKENDS[memory_backend]())
+        atexit.register(_store.flush)
+    return _store
 
-memory_db = {}
 
 def store_memory(mem_input: MemoryInput) -> MemoryOutput:
-    memory_db[mem_input.key] = mem_input.value
-    return MemoryOutput(memory_store=memory_db)
+    get_store().set(mem_input.session_id, mem_input.key, mem_input.value)
+    return MemoryOutput(session_id=mem_input.session_id, key=mem_input.key)
 
-def get_memory(key: str) -> dict:
-    return memory_db.get(key, {})
\ No newline at end of file
+async def get_memory(key: str, session_id: str = "default") -> dict:
+    return await get_store().aget(session_id, key) or {}
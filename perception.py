@@ -1,35 +1,50 @@
 # perception.py
+import logging
 from pydantic import BaseModel
-from typing import Optional
-import asyncio
-import os
-from google import genai
-from config import llm
+from typing import AsyncIterator
+from llm_gateway import get_gateway
+from cache import get_cache
+from telemetry import current_span
+from config import perception_cache_ttl
 
+log = logging.getLogger(__name__)
 
 
 class PerceptionInput(BaseModel):
-    system_prompt: str
+    system_prompt: str  # static, so it can be cached provider-side
     user_query: str
+    preamble: str = ""  # per-session/per-query context sent ahead of the query
 
 class PerceptionOutput(BaseModel):
     llm_prompt: str
     model_response: str
 
+def build_query(input_data: PerceptionInput) -> str:
+    query = f"Logistics Query: {input_data.user_query}"
+    return f"{input_data.preamble}\n\n{query}" if input_data.preamble else query
+
 def build_prompt(input_data: PerceptionInput) -> str:
-    return f"{input_data.system_prompt}\n\nLogistics Query: {input_data.user_query}"
+    return f"{input_data.system_prompt}\n\n{build_query(input_data)}"
+
+def _mark_cache(status: str):
+    # Annotates the caller's stage span (perceive/synthesize) with the cache outcome
+    record = current_span()
+    if record is not None:
+        record["cache"] = status
 
-async def perceive(input_data: PerceptionInput) -> PerceptionOutput:
-    # Load API key for Gemini
-    api_key = os.getenv("GEMINI_API_KEY")
-    client = genai.Client(api_key=api_key)
+async def perceive_stream(input_data: PerceptionInput) -> AsyncIterator[str]:
+    """Yield the model response in chunks as Gemini streams it (cached responses arrive as one chunk)."""
     prompt = build_prompt(input_data)
-    print("Sending prompt to Gemini...")
-    response = await asyncio.get_event_loop().run_in_executor(
-        None,
-        lambda: client.models.generate_content(
-            model=llm,
-            contents=prompt
-        )
-    )
-    return PerceptionOutput(llm_prompt=prompt, model_response=response.text.strip())
\ No newline at end of file
+    cache = get_cache()
+    cached = cache.get("prompt", "perceive", {"prompt": prompt}) if perception_cache_ttl > 0 else None
+    _mark_cache("miss" if cached is None else "hit")
+    if cached is not None:
+        log.debug("Using cached Gemini response")
+        yield cached
+        return
+    log.debug("Streaming prompt to Gemini...")
+    chunks = []
+    async for chunk in get_gateway().stream(build_query(input_data), system=input_data.system_prompt):
+        chunks.append(chunk)
+        yield chunk
+    cache.set("prompt", "perceive", {"prompt": prompt}, "".join(chunks).strip(), ttl=perception_cache_ttl)
@@ -0,0 +1,297 @@
+# router.py
+# Local intent router: maps unambiguous queries straight to a tool call so the first
+# perception round-trip to Gemini can be skipped. Anything it is unsure about goes to the LLM.
+#
+#   python router.py questions.xls                 # precision/recall at the configured threshold
+#   python router.py questions.xls --sweep         # ...and across a range of thresholds
+import re
+import json
+import argparse
+import numpy as np
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+from tool_schema import get_schemas
+from config import router_min_confidence
+
+# What each tool is for; the classifier is fitted on these. Required arguments come from tool_schema.
+TOOLS = {
+    "suggest_kpis": "warehouse kpis key performance indicators metrics track efficiency operations performance",
+    "calculate_storage_utilization": "storage utilization rate capacity used space percentage occupancy",
+    "optimize_picking_route": "picking route order picker travel path zone pick sequence",
+    "layout_optimization": "warehouse layout floor plan design workflow walking aisles square feet",
+    "receiving_process_improvement": "receiving process inbound unloading check in put away receiving procedures",
+    "warehouse_safety_checklist": "safety checklist hazards hazardous materials protocols accidents ppe injury",
+    "loading_dock_efficiency": "loading dock doors trucks inbound outbound dock scheduling waiting time",
+    "identify_bottlenecks": "bottlenecks delays congestion constraints throughput blockage",
+    "fleet_optimization": "fleet vehicles trucks delivery last mile fuel route planning transportation",
+    "suggest_inventory_kpis": "inventory kpis stock levels turnover rate stockouts overstock accuracy metrics",
+    "reorder_threshold": "reorder threshold reorder point lead time daily usage safety stock",
+    "estimate_restock_time": "restock time days of stock left current stock remaining depletion",
+    "cycle_count_strategy": "cycle counting cycle count inventory accuracy periodic continuous counts",
+    "forecast_inventory": "forecast demand forecasting seasonal holiday sales trends future inventory needs",
+    "return_processing_guide": "returns returned items reverse logistics return processing",
+    "suggest_slotting_strategy": "slotting strategy slot placement fast movers bulky perishable",
+    "packaging_material_advice": "packaging material boxes fragile cushioning sustainable packing",
+    "employee_training_plan": "training plan employees staff onboarding skills role operator manager",
+}
+
+# High-precision phrases; a rule firing for exactly one tool is strong evidence on its own.
+RULES = [
+    ("employee_training_plan", r"\btraining (plan|program)|\btrain(ing)? (new )?(staff|employees|operators?|managers?|pickers?)"),
+    ("warehouse_safety_checklist", r"\bsafety (checklist|protocols?|plan)\b"),
+    ("calculate_storage_utilization", r"\bstorage utili[sz]ation\b|\butili[sz]ation (rate|percentage)\b"),
+    ("optimize_picking_route", r"\bpick(ing)? routes?\b"),
+    ("layout_optimization", r"\blayout\b"),
+    ("receiving_process_improvement", r"\breceiving (process|procedures?|dock|area)\b"),
+    ("loading_dock_efficiency", r"\bloading docks?\b"),
+    ("identify_bottlenecks", r"\bbottlenecks?\b"),
+    ("fleet_optimization", r"\bfleet\b|\blast[- ]mile\b"),
+    ("suggest_inventory_kpis", r"\b(kpis?|metrics)\b.*\b(inventory|stock(outs?)?)\b|\binventory turnover rate\b"),
+    ("suggest_kpis", r"\bkpis?\b"),
+    ("reorder_threshold", r"\breorder (threshold|point|level)s?\b"),
+    ("estimate_restock_time", r"\brestock(ing)? time\b|\bdays of stock\b|\bstock (is|are) left\b"),
+    ("cycle_count_strategy", r"\bcycle count(s|ing)?\b"),
+    ("forecast_inventory", r"\bforecast(ing)?\b"),
+    ("return_processing_guide", r"\breturns? processing\b|\bprocessing returns\b|\breturned items\b"),
+    ("suggest_slotting_strategy", r"\bslotting\b"),
+    ("packaging_material_advice", r"\bpackaging\b"),
+]
+COMPILED_RULES = [(tool, re.compile(pattern, re.I)) for tool, pattern in RULES]
+RULE_CONFIDENCE = 0.9
+
+# Questions asking for several things at once; none of them may be routed to a single tool.
+COMPOUND_QUERIES = [
+    "Give me inventory KPIs, a safety checklist and a restock estimate",
+    "What KPIs should I track and what does a safety checklist look like?",
+    "Suggest a slotting strategy and a packaging material for fragile items",
+    "Plan the loading dock schedule and find the bottlenecks in receiving",
+    "Forecast holiday demand and set the reorder point for Widget-A",
+    "Design a training plan for pickers and optimize the pick route in zone B",
+]
+
+STOPWORDS = set("""a an and are be can do does for from how i if in is it of on or should that the this to
+                   what when which with would you your we our my they their there these those by as at""".split())
+
+ROLES = ["forklift operator", "warehouse manager", "inventory manager", "shift supervisor", "supervisor",
+         "inventory clerk", "receiving clerk", "shipping clerk", "dock worker", "order picker", "picker",
+         "packer", "loader", "driver"]
+SEASONS = ["holiday", "christmas", "black friday", "back to school", "summer", "winter", "spring", "autumn",
+           "fall", "peak", "q1", "q2", "q3", "q4"]
+GENERIC_PRODUCTS = {"product", "products", "item", "items", "goods", "a product", "the product", "inventory"}
+
+NUMBER = r"(\d[\d,]*(?:\.\d+)?)"
+NUMBER_PATTERNS = {
+    "total_capacity": [rf"\b(?:total )?capacity (?:of |is |= ?)?{NUMBER}", rf"{NUMBER} (?:units? )?(?:of )?(?:total )?capacity"],
+    "used_capacity": [rf"{NUMBER} units? (?:are |is )?(?:in use|used|occupied)", rf"\bused capacity (?:of |is )?{NUMBER}"],
+    "daily_usage": [rf"\bdaily usage (?:of |is |= ?)?{NUMBER}", rf"{NUMBER} units? (?:per|a|each) day"],
+    "lead_time_days": [rf"\blead time (?:of |is )?{NUMBER}"],
+    "current_stock": [rf"\bcurrent stock (?:of |is |level is )?{NUMBER}", rf"{NUMBER} units? (?:in|on) (?:stock|hand)"],
+}
+
+
+class Route(BaseModel):
+    tool_name: Optional[str] = None
+    arguments: dict = {}
+    confidence: float = 0.0
+    source: str = "none"  # "rule", "classifier" or "none"
+    missing: List[str] = []
+    compound: bool = False  # rules fired on separate parts of the query: more than one request
+
+    @property
+    def confident(self) -> bool:
+        return self.confident_at(router_min_confidence)
+
+    def confident_at(self, threshold: float) -> bool:
+        return self.tool_name is not None and not self.missing and not self.compound and self.confidence >= threshold
+
+    def as_function_call(self) -> str:
+        return "FUNCTION_CALL: " + json.dumps({"name": self.tool_name, "arguments": self.arguments})
+
+
+def tokenize(text: str) -> List[str]:
+    words = re.findall(r"[a-z][a-z0-9]+", text.lower().replace("-", " "))
+    # Crude plural folding keeps "kpis"/"kpi" and "returns"/"return" on the same feature
+    return [word[:-1] if word.endswith("s") and len(word) > 3 else word for word in words if word not in STOPWORDS]
+
+
+class ToolClassifier:
+    """TF-IDF nearest-centroid classifier over the tool catalog; probabilities via a softmax over cosine."""
+
+    def __init__(self, catalog: Dict[str, str], temperature: float = 0.05):
+        self.tools = list(catalog)
+        self.temperature = temperature
+        documents = [tokenize(f"{name.replace('_', ' ')} {text}") for name, text in catalog.items()]
+        self.vocabulary = {word: i for i, word in enumerate(sorted({w for doc in documents for w in doc}))}
+        counts = np.zeros((len(documents), len(self.vocabulary)))
+        for row, doc in enumerate(documents):
+            for word in doc:
+                counts[row, self.vocabulary[word]] += 1
+        self.idf = np.log((1 + len(documents)) / (1 + (counts > 0).sum(axis=0))) + 1
+        self.matrix = self._normalize(counts * self.idf)
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    def predict_proba(self, text: str) -> Dict[str, float]:
+        vector = np.zeros(len(self.vocabulary))
+        for word in tokenize(text):
+            index = self.vocabulary.get(word)
+            if index is not None:
+                vector[index] += 1
+        if not vector.any():
+            return {tool: 1 / len(self.tools) for tool in self.tools}
+        scores = self.matrix @ self._normalize(vector * self.idf)
+        weights = np.exp((scores - scores.max()) / self.temperature)
+        return dict(zip(self.tools, (weights / weights.sum()).tolist()))
+
+
+def _number(text: str) -> float:
+    value = float(text.replace(",", ""))
+    return int(value) if value.is_integer() else value
+
+
+def extract_arguments(query: str) -> dict:
+    """Pull product, role, zone, season, sizes and quantities out of free text where they are explicit."""
+    lowered = query.lower()
+    arguments = {}
+    for name, patterns in NUMBER_PATTERNS.items():
+        for pattern in patterns:
+            match = re.search(pattern, lowered)
+            if match:
+                arguments[name] = _number(match.group(1))
+                break
+    role = next((role for role in ROLES if re.search(rf"\b{role}s?\b", lowered)), None)
+    if role:
+        arguments["role"] = role
+    season = next((season for season in SEASONS if re.search(rf"\b{season}\b", lowered)), None)
+    if season:
+        arguments["season"] = season
+    zone = re.search(r"\bzone ([a-z]\b|\d+\b|[a-z]-?\d+\b)", query, re.I)
+    if zone:
+        arguments["zone"] = zone.group(1).upper()
+    size = re.search(rf"{NUMBER}[ -]?(square[ -]f(?:ee|oo)t|sq\.? ?ft|sqft|square met(?:er|re)s|m2)", lowered)
+    if size:
+        arguments["warehouse_size"] = f"{size.group(1)} {size.group(2)}"
+    else:
+        size = re.search(r"\b(small|medium|large|mid-sized)(?:-sized)? warehouse", lowered)
+        if size:
+            arguments["warehouse_size"] = size.group(1)
+    product = re.search(r"[\"']([^\"']{2,40})[\"']", query) or re.search(r"\b([A-Za-z]+-[A-Z0-9]+|SKU[- ]?\w+)\b", query)
+    if not product:
+        product = re.search(r"\bfor (?:a |an |the )?((?:[a-z-]+ ){0,2}(?:[a-z-]+))(?=\?|\.|,| that| with| during| in |$)", lowered)
+    if product and product.group(1).strip() not in GENERIC_PRODUCTS:
+        arguments["product"] = product.group(1).strip()
+        arguments["product_type"] = arguments["product"]
+    return arguments
+
+
+_classifier: Optional[ToolClassifier] = None
+
+
+def get_classifier() -> ToolClassifier:
+    global _classifier
+    if _classifier is None:
+        _classifier = ToolClassifier(TOOLS)
+    return _classifier
+
+
+def count_intents(spans: List[tuple]) -> int:
+    """Number of separate stretches of the query covered by rule matches (overlapping ones merge)."""
+    intents, end = 0, -1
+    for span_start, span_end in sorted(spans):
+        if span_start >= end:
+            intents += 1
+        end = max(end, span_end)
+    return intents
+
+
+def route_query(query: str) -> Route:
+    """
+    Score the query with the rules and the classifier. One firing rule gives RULE_CONFIDENCE;
+    several rules firing on the same words (e.g. "inventory KPIs") are tie-broken by the
+    classifier with a share-of-probability confidence, while rules firing on separate parts
+    of the query mark it compound and leave it to the LLM. With no rule the classifier's top
+    probability is used as is.
+    """
+    probabilities = get_classifier().predict_proba(query)
+    matches = {}
+    for tool, pattern in COMPILED_RULES:
+        match = pattern.search(query)
+        if match and tool not in matches:
+            matches[tool] = match.span()
+    hits = list(matches)
+    if len(hits) == 1:
+        tool, source = hits[0], "rule"
+        confidence = max(RULE_CONFIDENCE, probabilities[tool])
+    elif hits:
+        tool, source = max(hits, key=probabilities.get), "rule"
+        confidence = RULE_CONFIDENCE * probabilities[tool] / sum(probabilities[hit] for hit in hits)
+    else:
+        tool, source = max(probabilities, key=probabilities.get), "classifier"
+        confidence = probabilities[tool]
+
+    required = get_schemas()[tool].required
+    extracted = extract_arguments(query)
+    arguments = {name: extracted[name] for name in required if name in extracted}
+    return Route(tool_name=tool, arguments=arguments, confidence=round(confidence, 4), source=source,
+                 missing=[name for name in required if name not in extracted],
+                 compound=count_intents(list(matches.values())) > 1)
+
+
+def evaluate(questions, threshold: float) -> dict:
+    """Precision over the queries the router would answer itself, recall over all graded queries."""
+    graded = [question for question in questions if question.expected_tool]
+    routed = correct = 0
+    per_tool: Dict[str, Dict[str, int]] = {}
+    for question in graded:
+        route = route_query(question.question)
+        taken = route.confident_at(threshold)
+        stats = per_tool.setdefault(question.expected_tool, {"questions": 0, "routed": 0, "correct": 0})
+        stats["questions"] += 1
+        if taken:
+            routed += 1
+            stats["routed"] += 1
+            if route.tool_name == question.expected_tool:
+                correct += 1
+                stats["correct"] += 1
+    return {
+        "threshold": threshold,
+        "questions": len(graded),
+        "routed": routed,
+        "precision": round(correct / routed, 3) if routed else None,
+        "recall": round(correct / len(graded), 3) if graded else None,
+        # Multi-part questions routed to one tool anyway; should stay 0
+        "compound_routed": [query for query in COMPOUND_QUERIES if route_query(query).confident_at(threshold)],
+        "per_tool": per_tool,
+    }
+
+
+if __name__ == "__main__":
+    from batch_eval import load_questions
+    parser = argparse.ArgumentParser(description="Report local router precision/recall on a question file.")
+    parser.add_argument("questions", nargs="?", default="questions.xls")
+    parser.add_argument("--threshold", type=float, default=router_min_confidence)
+    parser.add_argument("--sweep", action="store_true", help="Also report a range of thresholds")
+    parser.add_argument("--verbose", action="store_true", help="Print the route chosen for every question")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    if args.verbose:
+        for question in questions:
+            route = route_query(question.question)
+            mark = "ok " if route.tool_name == question.expected_tool else "BAD"
+            print(f"{mark} {route.confidence:.2f} {route.source:10} {route.tool_name} {route.arguments} "
+                  f"missing={route.missing} <- {question.question}")
+        for query in COMPOUND_QUERIES:
+            route = route_query(query)
+            mark = "BAD" if route.confident else "ok "
+            print(f"{mark} {route.confidence:.2f} compound={route.compound} {route.tool_name} <- {query}")
+    print(json.dumps(evaluate(questions, args.threshold), indent=2))
+    if args.sweep:
+        for threshold in (0.5, 0.6, 0.7, 0.8, 0.9, 0.95):
+            report = evaluate(questions, threshold)
+            print(f"threshold={threshold:.2f} routed={report['routed']} "
+                  f"precision={report['precision']} recall={report['recall']} "
+                  f"compound_routed={len(report['compound_routed'])}")
@@ -0,0 +1,243 @@
+# scheduler.py
+# Admission control between the Chainlit front end and agent.main. Runs are limited globally
+# and per session, wait in a priority queue that is fair across sessions, are cancelled (with
+# their in-flight LLM and tool calls) when their deadline passes, and are turned away with a
+# fast "busy" reply when they could not finish in time anyway or Gemini's quota was just hit.
+#
+#   python bench_scheduler.py     # fairness, load shedding, deadlines and quota cooldown on the fake backend
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+from llm_gateway import get_gateway
+from telemetry import metrics
+from config import (scheduler_max_concurrency, scheduler_per_session, scheduler_max_queue,
+                    scheduler_max_session_pending, scheduler_deadline, scheduler_quota_cooldown,
+                    scheduler_cooldown_concurrency)
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Lower runs first; interactive chat should never queue behind background work
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+class SchedulerBusy(Exception):
+    """Rejected at admission. `reason` is "queue_full", "session_limit", "wait" or "quota"."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"busy ({reason}), retry in {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """The deadline passed while queued or running; a running job has been cancelled."""
+
+    def __init__(self, stage: str, deadline: float):
+        super().__init__(f"deadline of {deadline:g}s exceeded while {stage}")
+        self.stage = stage
+
+
+class _Ticket:
+    __slots__ = ("session_id", "priority", "ready", "started")
+
+    def __init__(self, session_id: str, priority: int, ready: asyncio.Future):
+        self.session_id = session_id
+        self.priority = priority
+        self.ready = ready  # resolved when a slot is granted, cancelled if the waiter gives up
+        self.started = 0.0
+
+
+class Scheduler:
+    """
+    Queue entries sort by (priority, requests the session already had pending, arrival), so
+    a session firing many queries only competes with other sessions' first query once its
+    earlier ones are through. A run holds one global and one per-session slot.
+    """
+
+    def __init__(self, max_concurrency: int = scheduler_max_concurrency, per_session: int = scheduler_per_session,
+                 max_queue: int = scheduler_max_queue, max_session_pending: int = scheduler_max_session_pending,
+                 deadline: float = scheduler_deadline, quota_cooldown: float = scheduler_quota_cooldown,
+                 cooldown_concurrency: int = scheduler_cooldown_concurrency):
+        self.max_concurrency = max_concurrency
+        self.per_session = per_session
+        self.max_queue = max_queue
+        self.max_session_pending = max_session_pending
+        self.deadline = deadline
+        self.quota_cooldown = quota_cooldown
+        self.cooldown_concurrency = max(1, min(cooldown_concurrency, max_concurrency))
+        self.loop = asyncio.get_running_loop()
+        self.completed = 0
+        self.shed = 0
+        self.expired = 0
+        self._heap: List[tuple] = []
+        self._order = itertools.count()
+        self._queued = 0
+        self._active = 0
+        self._running: Dict[str, int] = defaultdict(int)
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._avg_run_s: Optional[float] = None  # moving average of completed runs
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+    def cooldown_remaining(self) -> float:
+        if not self.quota_cooldown:
+            return 0.0
+        last = get_gateway().last_rate_limited
+        return 0.0 if last is None else max(0.0, last + self.quota_cooldown - time.monotonic())
+
+    def capacity(self) -> int:
+        return self.cooldown_concurrency if self.cooldown_remaining() else self.max_concurrency
+
+    def expected_wait(self) -> float:
+        """Rough queueing delay for a new request: whole 'waves' of runs ahead of it times the average run."""
+        if self._avg_run_s is None:
+            return 0.0
+        return (self._queued + self._active) // self.capacity() * self._avg_run_s
+
+    def _admit(self, session_id: str, deadline: float):
+        if self._pending.get(session_id, 0) >= self.max_session_pending:
+            raise SchedulerBusy("session_limit", self._avg_run_s or 1.0)
+        if self._queued >= self.max_queue:
+            raise SchedulerBusy("queue_full", self.expected_wait())
+        wait = self.expected_wait()
+        if deadline and wait >= deadline:
+            cooldown = self.cooldown_remaining()
+            raise SchedulerBusy("quota", cooldown) if cooldown else SchedulerBusy("wait", wait)
+
+    def _dispatch(self):
+        capacity = self.capacity()
+        deferred = []
+        while self._heap and self._active < capacity:
+            entry = heapq.heappop(self._heap)
+            ticket = entry[-1]
+            if ticket.ready.done():
+                continue  # the waiter gave up; it already left the queue count
+            if self._running[ticket.session_id] >= self.per_session:
+                deferred.append(entry)
+                continue
+            self._queued -= 1
+            self._active += 1
+            self._running[ticket.session_id] += 1
+            ticket.ready.set_result(None)
+        for entry in deferred:
+            heapq.heappush(self._heap, entry)
+        if self._heap and self._active < self.max_concurrency and capacity < self.max_concurrency:
+            # Capacity comes back when the quota cooldown ends, not when a run finishes
+            if self._wakeup is None or self._wakeup.cancelled():
+                self._wakeup = self.loop.call_later(self.cooldown_remaining() + 0.01, self._wake)
+        self._publish()
+
+    def _wake(self):
+        self._wakeup = None
+        self._dispatch()
+
+    def _release(self, ticket: _Ticket):
+        self._active -= 1
+        self._running[ticket.session_id] -= 1
+        if not self._running[ticket.session_id]:
+            del self._running[ticket.session_id]
+        self._dispatch()
+
+    def _leave(self, session_id: str):
+        self._pending[session_id] -= 1
+        if not self._pending[session_id]:
+            del self._pending[session_id]
+
+    def _publish(self):
+        metrics.set_gauge("scheduler_queue_depth", self._queued)
+        metrics.set_gauge("scheduler_running", self._active)
+        metrics.set_gauge("scheduler_capacity", self.capacity())
+
+    async def run(self, session_id: str, job: Callable[[], Awaitable[T]], priority: int = PRIORITY_INTERACTIVE,
+                  deadline: Optional[float] = None) -> T:
+        """
+        Run `job()` once a slot is free and return its result. `deadline` (seconds, default
+        `scheduler_deadline`, 0 for none) covers queueing and running together. Raises
+        SchedulerBusy without queueing, or DeadlineExceeded after cancelling the job.
+        """
+        deadline = self.deadline if deadline is None else deadline
+        submitted = time.perf_counter()
+        try:
+            self._admit(session_id, deadline)
+        except SchedulerBusy as e:
+            self.shed += 1
+            metrics.inc("scheduler_requests_total", outcome="shed", stage="admission")
+            metrics.inc("scheduler_shed_total", reason=e.reason)
+            log.warning("Shedding request from session %s: %s", session_id, e)
+            raise
+
+        ticket = _Ticket(session_id, priority, self.loop.create_future())
+        heapq.heappush(self._heap, (priority, self._pending[session_id], next(self._order), ticket))
+        self._pending[session_id] += 1
+        self._queued += 1
+        self._dispatch()
+        try:
+            await asyncio.wait_for(ticket.ready, deadline or None)
+        except BaseException as e:
+            if ticket.ready.done() and not ticket.ready.cancelled():
+                self._release(ticket)  # the slot was granted just as the waiter gave up
+            else:
+                self._queued -= 1
+                self._publish()
+            self._leave(session_id)
+            metrics.observe("scheduler_wait_seconds", time.perf_counter() - submitted, priority=priority)
+            if isinstance(e, asyncio.TimeoutError):
+                self.expired += 1
+                metrics.inc("scheduler_requests_total", outcome="deadline", stage="queued")
+                raise DeadlineExceeded("queued", deadline) from None
+            metrics.inc("scheduler_requests_total", outcome="cancelled", stage="queued")
+            raise
+        metrics.observe("scheduler_wait_seconds", time.perf_counter() - submitted, priority=priority)
+
+        ticket.started = time.perf_counter()
+        outcome = "error"
+        try:
+            remaining = deadline - (ticket.started - submitted) if deadline else None
+            result = await asyncio.wait_for(job(), remaining)
+            outcome = "completed"
+            return result
+        except asyncio.TimeoutError:
+            outcome = "deadline"
+            self.expired += 1
+            log.warning("Cancelled run for session %s after its %gs deadline", session_id, deadline)
+            raise DeadlineExceeded("running", deadline) from None
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            duration = time.perf_counter() - ticket.started
+            if outcome == "completed":
+                self.completed += 1
+                self._avg_run_s = duration if self._avg_run_s is None else 0.8 * self._avg_run_s + 0.2 * duration
+            metrics.inc("scheduler_requests_total", outcome=outcome, stage="running")
+            metrics.observe("scheduler_run_seconds", duration, outcome=outcome)
+            self._leave(session_id)
+            self._release(ticket)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queued,
+            "running": self._active,
+            "capacity": self.capacity(),
+            "completed": self.completed,
+            "shed": self.shed,
+            "expired": self.expired,
+            "avg_run_s": round(self._avg_run_s, 3) if self._avg_run_s is not None else None,
+        }
+
+
+_scheduler: Optional[Scheduler] = None
+
+
+def get_scheduler() -> Scheduler:
+    """Return the process-wide scheduler for the running event loop."""
+    global _scheduler
+    if _scheduler is None or _scheduler.loop is not asyncio.get_running_loop():
+        _scheduler = Scheduler()
+    return _scheduler
@@ -0,0 +1,374 @@
+# semantic_cache.py
+# Answer cache in front of agent.main for reworded repeats of the same question. Queries are
+# embedded as hashed bag-of-words vectors; a hit needs cosine similarity above the threshold
+# *and* the same scope: the session's warehouse preferences plus the entities and numbers in
+# the query, so "lead time 7 days" never answers "lead time 9 days".
+#
+# Processes sharing SEMANTIC_CACHE_PATH re-read the snapshot whenever it changes on disk and merge
+# it with their own unsaved entries before writing, so the CLI below takes effect in live agents.
+# Inside an event loop that file I/O runs in a background thread; lookups only touch memory.
+#
+#   python semantic_cache.py --stats
+#   python semantic_cache.py --invalidate "warehouse KPIs"    # drop entries similar to a query
+#   python semantic_cache.py --clear
+import os
+import re
+import json
+import time
+import atexit
+import asyncio
+import hashlib
+import logging
+import argparse
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, Optional
+from pydantic import BaseModel
+from router import tokenize, extract_arguments
+from config import (llm, llm_backend, semantic_cache_path, semantic_cache_threshold, semantic_cache_max_entries,
+                    semantic_cache_dim, semantic_cache_ttl, semantic_cache_snapshot_every,
+                    semantic_cache_refresh_interval)
+
+log = logging.getLogger(__name__)
+
+# Phrasing that does not change what is being asked
+FILLER = {"what", "which", "should", "could", "would", "track", "recommend", "suggest", "give", "tell", "me",
+          "list", "best", "top", "good", "need", "want", "know", "please", "some", "any", "all", "most",
+          "important", "key", "main", "help", "use", "used"}
+
+
+class CacheEntry(BaseModel):
+    query: str
+    scope: str
+    answer: str
+    created_at: float
+    latency_s: float = 0.0
+    hits: int = 0
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(word for word in tokenize(query) if word not in FILLER)
+
+
+def _bucket(word: str, dim: int):
+    digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+    value = int.from_bytes(digest, "little")
+    return value % dim, 1.0 if (value >> 63) else -1.0
+
+
+def embed(normalized: str, dim: int = semantic_cache_dim) -> np.ndarray:
+    """Signed feature hashing of unigrams and bigrams, L2-normalized (a zero vector for empty text)."""
+    words = normalized.split()
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+        index, sign = _bucket(feature, dim)
+        # Bigrams only refine: word overlap should dominate similarity
+        vector[index] += sign * (1.0 if " " not in feature else 0.5)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _key(entry: CacheEntry):
+    return entry.query, entry.scope, entry.created_at
+
+
+def _signature(path: str):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def scope_key(query: str, preferences: dict) -> str:
+    # Free-text products stay in the vector; only exact identifiers (SKUs, quoted names) scope
+    entities = {k: v for k, v in extract_arguments(query).items() if k in ("role", "zone", "season")}
+    entities["ids"] = sorted(set(re.findall(r"[\"']([^\"']{2,40})[\"']|\b([A-Za-z]+-[A-Z0-9]+|SKU[- ]?\w+)\b", query)))
+    numbers = sorted(re.findall(r"\d+(?:\.\d+)?", query.replace(",", "")))
+    payload = json.dumps({"model": f"{llm_backend}:{llm}", "preferences": preferences, "entities": entities,
+                          "numbers": numbers}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+class SemanticCache:
+    """
+    Bounded LRU of answers with a preallocated (max_entries x dim) matrix of query vectors;
+    a lookup is one masked matrix-vector product. Snapshots are plain JSON (vectors are recomputed).
+    The snapshot file is the shared state: when it changes on disk the cache is rebuilt from it,
+    keeping only the entries stored (and dropping the ones invalidated) here since the last sync.
+    Syncs run in a background task when there is an event loop, inline otherwise (scripts, the CLI).
+    """
+
+    def __init__(self, path: Optional[str] = semantic_cache_path, threshold: float = semantic_cache_threshold,
+                 max_entries: int = semantic_cache_max_entries, dim: int = semantic_cache_dim,
+                 ttl: float = semantic_cache_ttl, snapshot_every: int = semantic_cache_snapshot_every,
+                 refresh_interval: float = semantic_cache_refresh_interval):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.dim = dim
+        self.ttl = ttl
+        self.snapshot_every = snapshot_every
+        self.refresh_interval = refresh_interval
+        self.vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self.scopes = np.array([""] * max_entries, dtype=object)
+        self.entries: "OrderedDict[int, CacheEntry]" = OrderedDict()  # slot -> entry, least recent first
+        self.free = list(range(max_entries - 1, -1, -1))
+        self.lookups = 0
+        self.hits = 0
+        self.saved_latency_s = 0.0
+        self._dirty = 0
+        self._synced = None    # (mtime, size) of the snapshot file as of our last read or write
+        self._pending = set()  # keys stored here but not written yet
+        self._dropped = set()  # keys invalidated here but not written yet
+        self._checked = time.monotonic()
+        self._lock = threading.RLock()  # guards the in-memory state; never held across file I/O
+        self._sync_lock = threading.Lock()  # one refresh or snapshot at a time
+        self._syncer: Optional[asyncio.Task] = None
+        self._write_requested = False
+        if path:
+            self._request_sync()  # the initial load
+
+    def _release(self, slot: int):
+        self.entries.pop(slot, None)
+        self.vectors[slot] = 0
+        self.scopes[slot] = ""
+        self.free.append(slot)
+
+    def lookup(self, query: str, preferences: dict) -> Optional[CacheEntry]:
+        vector = embed(normalize_query(query), self.dim)
+        scope = scope_key(query, preferences)
+        if self.path and time.monotonic() - self._checked >= self.refresh_interval:
+            self._checked = time.monotonic()
+            self._request_sync()
+        with self._lock:
+            self.lookups += 1
+            if not vector.any() or not self.entries:
+                return None
+            slots = np.fromiter(self.entries.keys(), dtype=np.int64)
+            candidates = slots[self.scopes[slots] == scope]
+            if candidates.size == 0:
+                return None
+            similarities = self.vectors[candidates] @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            slot = int(candidates[best])
+            entry = self.entries[slot]
+            if self.ttl and time.time() - entry.created_at > self.ttl:
+                self._release(slot)
+                return None
+            entry.hits += 1
+            self.entries.move_to_end(slot)
+            self.hits += 1
+            self.saved_latency_s += entry.latency_s
+            return entry
+
+    def store(self, query: str, preferences: dict, answer: str, latency_s: float = 0.0,
+              created_at: Optional[float] = None):
+        normalized = normalize_query(query)
+        vector = embed(normalized, self.dim)
+        if not vector.any():
+            return
+        scope = scope_key(query, preferences)
+        with self._lock:
+            # Replace a near-identical entry instead of storing the same question twice
+            if self.entries:
+                slots = np.fromiter(self.entries.keys(), dtype=np.int64)
+                same = slots[(self.scopes[slots] == scope) & (self.vectors[slots] @ vector >= 0.999)]
+                for slot in same.tolist():
+                    self._drop(slot)
+            if not self.free:
+                self._release(next(iter(self.entries)))
+            slot = self.free.pop()
+            self.vectors[slot] = vector
+            self.scopes[slot] = scope
+            entry = CacheEntry(query=query, scope=scope, answer=answer, latency_s=latency_s,
+                               created_at=created_at or time.time())
+            self.entries[slot] = entry
+            self._pending.add(_key(entry))
+            self._dirty += 1
+            write = self.snapshot_every and self._dirty >= self.snapshot_every
+        if self.path and write:
+            self._request_sync(write=True)
+
+    def invalidate(self, query: Optional[str] = None, older_than: Optional[float] = None,
+                   threshold: Optional[float] = None) -> int:
+        """
+        Drop entries similar to `query` (any scope) and/or created before `older_than`
+        (a timestamp); with neither, clear everything. Returns the number dropped.
+        """
+        self._refresh()
+        with self._lock:
+            doomed = set()
+            if query is None and older_than is None:
+                doomed = set(self.entries)
+            if query is not None:
+                vector = embed(normalize_query(query), self.dim)
+                slots = np.fromiter(self.entries.keys(), dtype=np.int64)
+                doomed |= set(slots[self.vectors[slots] @ vector >= (threshold or self.threshold)].tolist())
+            if older_than is not None:
+                doomed |= {slot for slot, entry in self.entries.items() if entry.created_at < older_than}
+            for slot in doomed:
+                self._drop(slot)
+            if doomed:
+                self._dirty += 1
+            return len(doomed)
+
+    def clear(self) -> int:
+        return self.invalidate()
+
+    def _drop(self, slot: int):
+        key = _key(self.entries[slot])
+        self._pending.discard(key)
+        self._dropped.add(key)
+        self._release(slot)
+
+    def _request_sync(self, write: bool = False):
+        """Refresh from (and with `write`, snapshot to) the file without blocking the event loop."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._sync(write)
+            return
+        self._write_requested |= write
+        if self._syncer is None or self._syncer.done() or self._syncer.get_loop() is not loop:
+            self._syncer = loop.create_task(self._sync_loop(), name="semantic-cache-sync")
+
+    async def _sync_loop(self):
+        # Stores that ask for a snapshot while one is running get another pass
+        while True:
+            write, self._write_requested = self._write_requested, False
+            try:
+                await asyncio.to_thread(self._sync, write)
+            except Exception as e:
+                log.error("Syncing the semantic cache with %s failed: %s", self.path, e)
+            if not self._write_requested:
+                return
+
+    def _sync(self, write: bool):
+        if write:
+            self.snapshot()
+        else:
+            self._refresh()
+
+    def _refresh(self):
+        """Rebuild from the snapshot file if another process (or the CLI) rewrote it since our last sync."""
+        if not self.path:
+            return
+        with self._sync_lock:
+            signature = _signature(self.path)
+            if signature == self._synced:
+                return
+            # Reading and embedding the file is the slow part; lookups keep the old state meanwhile
+            entries = self._read(self.path) if signature else []
+            vectors = [embed(normalize_query(entry.query), self.dim) for entry in entries]
+            with self._lock:
+                local = [(entry, self.vectors[slot].copy()) for slot, entry in self.entries.items()
+                         if _key(entry) in self._pending]
+                self.entries.clear()
+                self.vectors[:] = 0
+                self.scopes[:] = ""
+                self.free = list(range(self.max_entries - 1, -1, -1))
+                for entry, vector in zip(entries, vectors):
+                    if _key(entry) not in self._dropped and _key(entry) not in self._pending:
+                        self._restore(entry, vector)
+                for entry, vector in local:
+                    self._restore(entry, vector)
+                self._synced = signature
+
+    def snapshot(self, path: Optional[str] = None):
+        path = path or self.path
+        if not path:
+            return
+        shared = path == self.path
+        if shared:
+            self._refresh()
+        with self._sync_lock:
+            with self._lock:
+                entries = [entry.model_dump() for entry in self.entries.values()]
+                pending, dropped = set(self._pending), set(self._dropped)
+                self._dirty = 0
+            tmp = f"{path}.tmp.{os.getpid()}"
+            with open(tmp, "w", encoding="utf-8") as handle:
+                json.dump({"dim": self.dim, "entries": entries}, handle)
+            os.replace(tmp, path)
+            if shared:
+                with self._lock:
+                    self._synced = _signature(path)
+                    # Anything stored or dropped while writing goes out with the next snapshot
+                    self._pending -= pending
+                    self._dropped -= dropped
+
+    @staticmethod
+    def _read(path: str):
+        try:
+            with open(path, encoding="utf-8") as handle:
+                data = json.load(handle)
+        except FileNotFoundError:
+            return []
+        return [CacheEntry(**raw) for raw in data.get("entries", [])]
+
+    def load(self, path: str):
+        # Entries are stored least recent first, so re-inserting them restores the LRU order
+        entries = self._read(path)
+        with self._lock:
+            for entry in entries:
+                self._restore(entry)
+            self._dirty = 0
+
+    def _restore(self, entry: CacheEntry, vector: Optional[np.ndarray] = None):
+        if vector is None:
+            vector = embed(normalize_query(entry.query), self.dim)
+        if not vector.any() or (self.ttl and time.time() - entry.created_at > self.ttl):
+            return
+        if not self.free:
+            self._release(next(iter(self.entries)))
+        slot = self.free.pop()
+        self.vectors[slot] = vector
+        self.scopes[slot] = entry.scope
+        self.entries[slot] = entry
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "entries": len(self.entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else 0.0,
+            "saved_latency_s": round(self.saved_latency_s, 3),
+        }
+
+
+_cache: Optional[SemanticCache] = None
+
+
+def get_semantic_cache() -> SemanticCache:
+    global _cache
+    if _cache is None:
+        _cache = SemanticCache()
+        atexit.register(_cache.snapshot)
+    return _cache
+
+
+def set_semantic_cache(cache: Optional[SemanticCache]):
+    """Swap the process-wide cache, e.g. for an in-memory one in batch runs; None restores the default."""
+    global _cache
+    _cache = cache
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or invalidate the semantic answer cache snapshot.")
+    parser.add_argument("--stats", action="store_true")
+    parser.add_argument("--invalidate", metavar="QUERY", help="Drop entries similar to QUERY")
+    parser.add_argument("--older-than-hours", type=float, help="Drop entries older than this many hours")
+    parser.add_argument("--clear", action="store_true")
+    args = parser.parse_args()
+
+    cache = get_semantic_cache()
+    if args.clear:
+        print(f"Dropped {cache.clear()} entries")
+    elif args.invalidate or args.older_than_hours:
+        older_than = time.time() - args.older_than_hours * 3600 if args.older_than_hours else None
+        print(f"Dropped {cache.invalidate(args.invalidate, older_than)} entries")
+    print(json.dumps(cache.stats(), indent=2))
@@ -0,0 +1,279 @@
+# telemetry.py
+# Spans, counters and histograms for the perceive/decide/act/synthesize loop.
+#
+#   METRICS_PORT=9100      serve Prometheus text format on http://localhost:9100/metrics
+#   METRICS_FILE=m.json    dump all metrics as JSON at exit
+#   LOG_LEVEL=DEBUG        also log every span plus full prompts and responses
+#   TRACE_FILE=t.jsonl     append one JSON line per finished span
+#   PROFILE_FILE=p.txt     sample the event-loop thread and write collapsed stacks at exit
+import sys
+import json
+import time
+import uuid
+import atexit
+import logging
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from config import log_level, metrics_port, metrics_file, trace_file, profile_file, profile_interval
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Process-local counters, gauges and histograms; label values should be low-cardinality."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, Dict[LabelKey, float]] = defaultdict(lambda: defaultdict(float))
+        self.gauges: Dict[str, Dict[LabelKey, float]] = defaultdict(dict)
+        self.histograms: Dict[str, Dict[LabelKey, Histogram]] = defaultdict(dict)
+        self._buckets: Dict[str, tuple] = {}
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        with self._lock:
+            self.counters[name][_label_key(labels)] += amount
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self.gauges[name][_label_key(labels)] = value
+
+    def observe(self, name: str, value: float, buckets=DEFAULT_BUCKETS, **labels):
+        with self._lock:
+            series = self.histograms[name]
+            key = _label_key(labels)
+            if key not in series:
+                series[key] = Histogram(self._buckets.setdefault(name, tuple(buckets)))
+            series[key].observe(value)
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                lines += [f"{name}{_format_labels(key)} {value:g}" for key, value in series.items()]
+            for name, series in sorted(self.gauges.items()):
+                lines.append(f"# TYPE {name} gauge")
+                lines += [f"{name}{_format_labels(key)} {value:g}" for key, value in series.items()]
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{name}_bucket{_format_labels(key, (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.total:g}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        def labelled(series, value):
+            return [{"labels": dict(key), **value(item)} for key, item in series.items()]
+
+        with self._lock:
+            return {
+                "counters": {n: labelled(s, lambda v: {"value": v}) for n, s in self.counters.items()},
+                "gauges": {n: labelled(s, lambda v: {"value": v}) for n, s in self.gauges.items()},
+                "histograms": {
+                    n: labelled(s, lambda h: {"count": h.count, "sum": h.total,
+                                              "buckets": dict(zip(map(str, h.buckets + ("+Inf",)), h.counts))})
+                    for n, s in self.histograms.items()
+                },
+            }
+
+    def dump(self, path: str):
+        with open(path, "w", encoding="utf-8") as handle:
+            json.dump(self.snapshot(), handle, indent=2)
+
+
+metrics = MetricsRegistry()
+
+# Attributes every span in the current task inherits (session id, iteration, ...)
+_trace_attrs: ContextVar[dict] = ContextVar("trace_attrs", default={})
+_current_span: ContextVar[Optional[dict]] = ContextVar("current_span", default=None)
+_trace_lock = threading.Lock()
+
+
+@contextmanager
+def trace_attributes(**attrs):
+    """Attach attributes (session id, ...) to every span opened in this block."""
+    token = _trace_attrs.set({**_trace_attrs.get(), **attrs})
+    try:
+        yield
+    finally:
+        _trace_attrs.reset(token)
+
+
+def _new_record(stage: str, attrs: dict) -> dict:
+    parent = _current_span.get()
+    return {
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent["span_id"] if parent else None,
+        "stage": stage,
+        **_trace_attrs.get(),
+        **attrs,
+    }
+
+
+def _finish(record: dict, duration: float):
+    record["duration_s"] = round(duration, 6)
+    status = "error" if "error" in record else "ok"
+    metrics.observe("stage_duration_seconds", duration, stage=record["stage"], status=status)
+    for kind in ("prompt_tokens", "response_tokens"):
+        if isinstance(record.get(kind), (int, float)):
+            metrics.observe(f"stage_{kind}", record[kind], buckets=TOKEN_BUCKETS, stage=record["stage"])
+    log.debug("span %s", record)
+    if trace_file:
+        with _trace_lock, open(trace_file, "a", encoding="utf-8") as handle:
+            handle.write(json.dumps(record, default=str) + "\n")
+
+
+@contextmanager
+def span(stage: str, **attrs):
+    """
+    Time one stage of the loop. Yields a dict the caller can add attributes to (token
+    counts, cache status, ...); the duration lands in `stage_duration_seconds{stage=...}`.
+    """
+    record = _new_record(stage, attrs)
+    token = _current_span.set(record)
+    record["start"] = time.time()
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        _finish(record, time.perf_counter() - start)
+
+
+def record_span(stage: str, started: float, **attrs):
+    """
+    Emit a finished span that began at `started` (a time.perf_counter() value). For async
+    generators, which cannot hold a span() open across yields without leaking it to the consumer.
+    """
+    duration = time.perf_counter() - started
+    record = _new_record(stage, attrs)
+    record["start"] = time.time() - duration
+    _finish(record, duration)
+
+
+def current_span() -> Optional[dict]:
+    return _current_span.get()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = metrics.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    log.info("Serving metrics on http://127.0.0.1:%d/metrics", port)
+    return server
+
+
+class SamplingProfiler:
+    """
+    Low-overhead statistical profiler for the hot path: a background thread samples the
+    target thread's stack every `interval` seconds and counts collapsed stacks, which
+    flamegraph.pl / speedscope can render directly.
+    """
+
+    def __init__(self, interval: float = profile_interval, thread_id: Optional[int] = None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self, path: Optional[str] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if path:
+            with open(path, "w", encoding="utf-8") as handle:
+                for stack, count in self.samples.most_common():
+                    handle.write(f"{stack} {count}\n")
+
+
+_configured = False
+
+
+def setup():
+    """Configure logging and start the optional exporters/profiler; safe to call more than once."""
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    logging.basicConfig(level=log_level, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    if metrics_file:
+        atexit.register(metrics.dump, metrics_file)
+    if profile_file:
+        profiler = SamplingProfiler()
+        profiler.start()
+        atexit.register(profiler.stop, profile_file)
@@ -0,0 +1,133 @@
+# tool_catalog.py
+# The tool catalog as the MCP server reports it (list_tools), cached, plus a BM25 index so the
+# system prompt only lists the tools relevant to the query instead of the whole catalog.
+import time
+import asyncio
+import logging
+import numpy as np
+from typing import List, Optional
+from pydantic import BaseModel
+from router import tokenize
+from tool_schema import get_schemas
+from mcp_pool import get_pool
+from config import tool_catalog_ttl, tool_catalog_retry, tool_top_k
+
+log = logging.getLogger(__name__)
+
+JSON_TYPES = {"integer": "int", "number": "float", "string": "str", "boolean": "bool", "object": "dict", "array": "list"}
+
+
+class ToolInfo(BaseModel):
+    name: str
+    description: str = ""
+    signature: str
+
+    def render(self) -> str:
+        return f"- {self.signature}: {self.description}" if self.description else f"- {self.signature}"
+
+
+def _json_type(schema: dict) -> str:
+    if "anyOf" in schema:
+        options = [option for option in schema["anyOf"] if option.get("type") != "null"]
+        inner = _json_type(options[0]) if options else "Any"
+        return f"Optional[{inner}]" if len(options) < len(schema["anyOf"]) else inner
+    if schema.get("type") == "array" and "items" in schema:
+        return f"List[{_json_type(schema['items'])}]"
+    return JSON_TYPES.get(schema.get("type"), "Any")
+
+
+def tool_from_mcp(tool) -> ToolInfo:
+    properties = (tool.inputSchema or {}).get("properties", {})
+    required = set((tool.inputSchema or {}).get("required", []))
+    params = [f"{name}: {_json_type(schema)}" + ("" if name in required else f" = {schema.get('default')!r}")
+              for name, schema in properties.items()]
+    return ToolInfo(name=tool.name, description=(tool.description or "").strip(),
+                    signature=f"{tool.name}({', '.join(params)})")
+
+
+class BM25Index:
+    """Okapi BM25 over small documents; the per-term weights are precomputed so a query is one gather + sum."""
+
+    def __init__(self, documents: List[List[str]], k1: float = 1.5, b: float = 0.75):
+        self.vocabulary = {word: i for i, word in enumerate(sorted({w for doc in documents for w in doc}))}
+        tf = np.zeros((len(documents), len(self.vocabulary)))
+        for row, doc in enumerate(documents):
+            for word in doc:
+                tf[row, self.vocabulary[word]] += 1
+        lengths = tf.sum(axis=1, keepdims=True)
+        average = lengths.mean() if len(documents) else 1.0
+        df = (tf > 0).sum(axis=0)
+        idf = np.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+        self.weights = idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths / average))
+
+    def scores(self, query: List[str]) -> np.ndarray:
+        ids = [self.vocabulary[word] for word in query if word in self.vocabulary]
+        if not ids:
+            return np.zeros(self.weights.shape[0])
+        return self.weights[:, ids].sum(axis=1)
+
+
+class ToolCatalog:
+    def __init__(self, tools: List[ToolInfo], ttl: float = tool_catalog_ttl):
+        self.tools = tools
+        self.fetched_at = time.monotonic()
+        self.ttl = ttl
+        # Name words count twice: they are the most specific signal in a one-line description
+        self.index = BM25Index([tokenize(f"{t.name.replace('_', ' ')} " * 2 + f"{t.description} {t.signature}")
+                                for t in tools])
+
+    def select(self, query: str, k: int = tool_top_k) -> List[ToolInfo]:
+        """Top-k tools for `query` in catalog order; the full catalog if k is 0 or nothing matches."""
+        if k <= 0 or k >= len(self.tools):
+            return list(self.tools)
+        scores = self.index.scores(tokenize(query))
+        if not scores.any():
+            return list(self.tools)
+        top = np.argsort(-scores, kind="stable")[:k]
+        return [self.tools[i] for i in sorted(top[scores[top] > 0])]
+
+    @property
+    def names(self) -> List[str]:
+        return [tool.name for tool in self.tools]
+
+
+def catalog_from_source() -> ToolCatalog:
+    """Offline fallback built from the mcp_server.py signatures and docstrings."""
+    return ToolCatalog([ToolInfo(name=s.name, description=s.doc, signature=s.signature()) for s in get_schemas().values()])
+
+
+_catalog: Optional[ToolCatalog] = None
+_refresh: Optional[asyncio.Task] = None
+
+
+async def _fetch() -> ToolCatalog:
+    global _catalog
+    try:
+        result = await get_pool().list_tools()
+        catalog = ToolCatalog([tool_from_mcp(tool) for tool in result.tools])
+    except Exception as e:
+        log.warning("list_tools failed, using the catalog parsed from mcp_server.py: %s", e)
+        catalog = catalog_from_source()
+        # Retry soon: a transient failure must not hide new or changed tools for the whole TTL
+        catalog.ttl = tool_catalog_retry
+    _catalog = catalog
+    return catalog
+
+
+async def get_catalog() -> ToolCatalog:
+    """
+    Fetch the catalog once per `tool_catalog_ttl` seconds (`tool_catalog_retry` after a failed
+    list_tools); concurrent callers share one list_tools.
+    """
+    global _refresh
+    if _catalog is not None and time.monotonic() - _catalog.fetched_at < _catalog.ttl:
+        return _catalog
+    loop = asyncio.get_running_loop()
+    if _refresh is None or _refresh.done() or _refresh.get_loop() is not loop:
+        _refresh = loop.create_task(_fetch())
+    return await asyncio.shield(_refresh)
+
+
+def invalidate_catalog():
+    global _catalog
+    _catalog = None
@@ -0,0 +1,193 @@
+# tool_results.py
+# Typed MCP tool results and their compact prompt form. A tool result is split into prose
+# (text), scalar figures (numbers) and column data (tables), each hard-capped on the way in,
+# and rendered into prompts under a token budget, so a prompt carries "utilization_pct=50"
+# rather than the repr of TextContent lists wrapping JSON.
+import re
+import json
+from typing import Any, Dict, List
+from pydantic import BaseModel
+from llm_gateway import estimate_tokens
+from config import (tool_result_max_text_tokens, tool_result_max_numbers, tool_result_max_table_rows,
+                    tool_result_max_cell_chars, tool_result_prompt_tokens, tool_result_prompt_rows,
+                    tool_result_policy)
+
+
+class Table(BaseModel):
+    columns: List[str]
+    rows: List[List[Any]]
+    total_rows: int = 0  # before the row cap
+
+    def render(self, max_rows: int = tool_result_prompt_rows) -> str:
+        rows = self.rows[:max_rows] if max_rows > 0 else self.rows
+        total = max(self.total_rows, len(self.rows))
+        shown = f"{len(rows)} of {total} rows" if total > len(rows) else f"{len(rows)} rows"
+        lines = [f"table ({shown}): " + "|".join(self.columns)]
+        lines += ["|".join(_format(cell) for cell in row) for row in rows]
+        return "\n".join(lines)
+
+
+class ToolResult(BaseModel):
+    tool_name: str
+    ok: bool = True
+    text: str = ""
+    numbers: Dict[str, float] = {}
+    tables: List[Table] = []
+    truncated: bool = False
+    raw_chars: int = 0  # size of the result as the old str(result.content) rendering
+    llm_calls: int = 0  # made by the tool itself inside the MCP server
+
+    @property
+    def structured(self) -> bool:
+        """True for data (calculations, tables) rather than prose meant for the user."""
+        return bool(self.numbers or self.tables)
+
+    def render(self, max_tokens: int = tool_result_prompt_tokens, policy: str = tool_result_policy,
+               max_rows: int = tool_result_prompt_rows) -> str:
+        """
+        Compact prompt form: the status line, then figures, tables and text. Figures and tables
+        are kept; the text gets what is left of `max_tokens` (0 for no budget), cut by `policy`.
+        """
+        head = f"[MCP Response] {self.tool_name}:" if self.ok else f"[MCP Error] {self.tool_name}:"
+        parts = []
+        if self.numbers:
+            parts.append(" ".join(f"{name}={_format(value)}" for name, value in self.numbers.items()))
+        parts += [table.render(max_rows) for table in self.tables]
+        if self.text:
+            used = estimate_tokens(head + "\n".join(parts))
+            parts.append(cap_text(self.text, max(64, max_tokens - used), policy) if max_tokens > 0 else self.text)
+        body = "\n".join(parts)
+        return f"{head} {body}" if "\n" not in body else f"{head}\n{body}"
+
+    def tokens(self) -> int:
+        return estimate_tokens(self.render())
+
+    def raw_tokens(self) -> int:
+        # Same ~4 characters per token rule as estimate_tokens()
+        return max(1, self.raw_chars // 4)
+
+
+def _format(value: Any) -> str:
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else f"{value:.6g}"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return " ".join(str(value).split())
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _scalar(value: Any) -> bool:
+    return value is None or isinstance(value, (str, int, float, bool))
+
+
+def cap_text(text: str, max_tokens: int, policy: str = "truncate") -> str:
+    """
+    Fit `text` into `max_tokens`. "truncate" keeps the start, "head_tail" the start and the
+    end (conclusions tend to sit there), "summarize" the first sentence of every paragraph or
+    list item, truncated if even that is too long. Cuts fall on word boundaries and are marked.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = max_tokens * 4
+    if policy == "head_tail":
+        half = budget // 2
+        head = text[:half].rsplit(" ", 1)[0]
+        tail = text[-half:].split(" ", 1)[-1]
+        return f"{head} … {tail}"
+    if policy == "summarize":
+        blocks = [block.strip() for block in re.split(r"\n\s*\n|\n(?=\s*(?:[-*•]|\d+[.)])\s)", text) if block.strip()]
+        firsts = [re.split(r"(?<=[.!?])\s", " ".join(block.split()), 1)[0] for block in blocks]
+        summary = "\n".join(firsts)
+        if len(summary) <= budget:
+            return summary
+        text = summary
+    return text[:budget].rsplit(" ", 1)[0] + " …"
+
+
+def _columns_table(data: Dict[str, list], max_rows: int, max_cell: int) -> Table:
+    columns = list(data)
+    total = len(next(iter(data.values())))
+    rows = [[_cell(data[column][i], max_cell) for column in columns] for i in range(min(total, max_rows))]
+    return Table(columns=columns, rows=rows, total_rows=total)
+
+
+def _records_table(records: List[dict], max_rows: int, max_cell: int) -> Table:
+    columns = list(dict.fromkeys(key for record in records for key in record))
+    rows = [[_cell(record.get(column), max_cell) for column in columns] for record in records[:max_rows]]
+    return Table(columns=columns, rows=rows, total_rows=len(records))
+
+
+def _cell(value: Any, max_cell: int) -> Any:
+    if isinstance(value, str) and len(value) > max_cell:
+        return value[:max_cell] + "…"
+    return value
+
+
+def from_data(tool_name: str, data: Any, max_text_tokens: int = tool_result_max_text_tokens,
+              max_numbers: int = tool_result_max_numbers, max_rows: int = tool_result_max_table_rows,
+              max_cell: int = tool_result_max_cell_chars) -> ToolResult:
+    """Split decoded tool output into text, numbers and tables, applying the hard size caps."""
+    result = ToolResult(tool_name=tool_name)
+    lines: List[str] = []
+    if isinstance(data, dict) and isinstance(data.get("llm_usage"), dict):
+        # Bookkeeping from mcp_server.reports_llm_usage, not something the model should read
+        data = dict(data)
+        result.llm_calls = int(data.pop("llm_usage").get("calls", 0))
+    if isinstance(data, dict) and isinstance(data.get("content"), list):
+        # LLM-backed tools return {"content": [TextContent]}, which FastMCP sends on as JSON text
+        lines += [str(item.get("text", "")) for item in data["content"] if isinstance(item, dict)]
+    elif isinstance(data, dict):
+        columns = {key: value for key, value in data.items()
+                   if isinstance(value, list) and value and all(_scalar(item) for item in value)}
+        if len({len(value) for value in columns.values()}) == 1 and len(columns) > 1:
+            result.tables.append(_columns_table(columns, max_rows, max_cell))
+        else:
+            columns = {}
+        for key, value in data.items():
+            if key in columns:
+                continue
+            if _is_number(value):
+                result.numbers[key] = value
+            elif isinstance(value, list) and value and all(isinstance(item, dict) for item in value):
+                result.tables.append(_records_table(value, max_rows, max_cell))
+            elif value is not None:
+                lines.append(f"{key}: {_format(value) if _scalar(value) else json.dumps(value, separators=(',', ':'))}")
+    elif isinstance(data, list) and data and all(isinstance(item, dict) for item in data):
+        result.tables.append(_records_table(data, max_rows, max_cell))
+    elif _is_number(data):
+        result.numbers["value"] = data
+    else:
+        lines.append(data if isinstance(data, str) else json.dumps(data, separators=(",", ":")))
+
+    if len(result.numbers) > max_numbers:
+        result.numbers = dict(list(result.numbers.items())[:max_numbers])
+        result.truncated = True
+    text = "\n".join(lines).strip()
+    result.text = cap_text(text, max_text_tokens)
+    result.truncated = result.truncated or result.text != text or \
+        any(table.total_rows > len(table.rows) for table in result.tables)
+    return result
+
+
+def from_mcp(tool_name: str, mcp_result: Any, **caps) -> ToolResult:
+    """Build a ToolResult from an MCP CallToolResult (or anything with a similar shape)."""
+    items = getattr(mcp_result, "content", None)
+    raw = str(items if items is not None else mcp_result)
+    texts = [getattr(item, "text", None) for item in items] if items is not None else [raw]
+    text = "\n".join(t for t in texts if t is not None)
+    try:
+        data = json.loads(text)
+    except ValueError:
+        data = text
+    result = from_data(tool_name, data, **caps)
+    result.ok = not getattr(mcp_result, "isError", False)
+    result.raw_chars = len(raw)
+    return result
+
+
+def error_result(tool_name: str, message: str) -> ToolResult:
+    return ToolResult(tool_name=tool_name, ok=False, text=cap_text(message, tool_result_max_text_tokens),
+                      raw_chars=len(message))
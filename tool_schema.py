@@ -0,0 +1,106 @@
+# tool_schema.py
+# Argument validators for the MCP tools, compiled once from the @mcp.tool() signatures in
+# mcp_server.py. The server module is parsed with `ast` rather than imported, so the client
+# never starts FastMCP or touches its command line.
+import os
+import ast
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Type
+from pydantic import BaseModel, ConfigDict, ValidationError, create_model
+
+SERVER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mcp_server.py")
+
+# Names an annotation in mcp_server.py may use
+ANNOTATION_NAMES = {"int": int, "float": float, "str": str, "bool": bool, "dict": dict, "list": list,
+                    "List": List, "Dict": Dict, "Optional": Optional, "Any": Any}
+
+
+class ToolParam(BaseModel):
+    name: str
+    annotation: str
+    required: bool
+    default: Any = None
+
+
+class ToolSchema(BaseModel):
+    name: str
+    params: List[ToolParam]
+    doc: str = ""
+
+    @property
+    def required(self) -> List[str]:
+        return [param.name for param in self.params if param.required]
+
+    def signature(self) -> str:
+        rendered = [f"{p.name}: {p.annotation}" + ("" if p.required else f" = {p.default!r}") for p in self.params]
+        return f"{self.name}({', '.join(rendered)})"
+
+
+def _is_tool(node: ast.AsyncFunctionDef) -> bool:
+    for decorator in node.decorator_list:
+        target = decorator.func if isinstance(decorator, ast.Call) else decorator
+        if isinstance(target, ast.Attribute) and target.attr == "tool":
+            return True
+    return False
+
+
+def parse_tools(path: str = SERVER_SOURCE) -> Dict[str, ToolSchema]:
+    with open(path, encoding="utf-8") as handle:
+        tree = ast.parse(handle.read(), filename=path)
+    tools = {}
+    for node in tree.body:
+        if not isinstance(node, (ast.AsyncFunctionDef, ast.FunctionDef)) or not _is_tool(node):
+            continue
+        args = node.args.args
+        defaults = [None] * (len(args) - len(node.args.defaults)) + node.args.defaults
+        params = [
+            ToolParam(
+                name=arg.arg,
+                annotation=ast.unparse(arg.annotation) if arg.annotation is not None else "Any",
+                required=default is None,
+                default=ast.literal_eval(default) if default is not None else None,
+            )
+            for arg, default in zip(args, defaults)
+        ]
+        tools[node.name] = ToolSchema(name=node.name, params=params, doc=ast.get_docstring(node) or "")
+    return tools
+
+
+def _compile(schema: ToolSchema) -> Type[BaseModel]:
+    fields: Dict[str, Tuple[Any, Any]] = {}
+    for param in schema.params:
+        annotation = eval(param.annotation, {"__builtins__": {}}, ANNOTATION_NAMES)
+        fields[param.name] = (annotation, ... if param.required else param.default)
+    # Lax mode coerces "50" -> 50 and 50.0 -> 50, plus 50000 -> "50000" for str parameters;
+    # arguments the tool does not take are dropped
+    config = ConfigDict(extra="ignore", coerce_numbers_to_str=True)
+    return create_model(f"{schema.name}_arguments", __config__=config, **fields)
+
+
+@lru_cache(maxsize=1)
+def get_schemas() -> Dict[str, ToolSchema]:
+    return parse_tools()
+
+
+@lru_cache(maxsize=1)
+def get_validators() -> Dict[str, Type[BaseModel]]:
+    return {name: _compile(schema) for name, schema in get_schemas().items()}
+
+
+def validate_arguments(tool_name: str, arguments: dict) -> Tuple[dict, List[str]]:
+    """Return (coerced arguments, errors); errors are short, model-readable sentences."""
+    validator = get_validators().get(tool_name)
+    if validator is None:
+        return arguments, [f'unknown tool "{tool_name}"']
+    try:
+        model = validator.model_validate(arguments)
+    except ValidationError as e:
+        errors = []
+        for error in e.errors():
+            field = ".".join(str(part) for part in error["loc"]) or "arguments"
+            if error["type"] == "missing":
+                errors.append(f'{tool_name}: missing required argument "{field}"')
+            else:
+                errors.append(f'{tool_name}: argument "{field}" {error["msg"].lower()} (got {error.get("input")!r})')
+        return arguments, errors
+    return model.model_dump(exclude_unset=True), []